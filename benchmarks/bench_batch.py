@@ -0,0 +1,36 @@
+"""
+    Benchmark for the batched engine.
+
+    Runs INVADERS on increasing numbers of machines at once and reports instructions and
+    environment steps (frames) per second.
+
+    Run from the repository root with:  python -m benchmarks.bench_batch
+"""
+import time
+
+from chip8.batch import BatchMachine
+from chip8.scheduler import DEFAULT_HZ
+
+ROM = "c8games/INVADERS"
+FRAMES = 60
+
+
+def main():
+    for count in (1, 10, 100, 1000):
+        batch = BatchMachine(count)
+        batch.load_rom(ROM)
+        started = time.perf_counter()
+        for frame in range(FRAMES):
+            # Everyone presses 5 to start the game,  then holds left
+            batch.keys[:] = False
+            batch.keys[:, 5 if frame < 30 else 4] = True
+            batch.run_frame(DEFAULT_HZ)
+            batch.frames()
+        elapsed = time.perf_counter() - started
+        steps = count * FRAMES
+        print(f"  {count:>5} machines {batch.cycles.sum() / elapsed:>14,.0f} instructions/sec"
+              f" {steps / elapsed:>12,.0f} frames/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+    Benchmark for frame capture.
+
+    Runs every bundled rom for a few thousand frames with NullDisplay and again capturing every
+    frame with CaptureDisplay,  and reports what capturing costs per frame and how big the
+    capture is against storing every frame whole.  The plain and capturing runs are
+    interleaved and the fastest of each compared,  a cost lost in the noise shows as 0.
+    Then times reading frames back in order and at random,  and exporting a GIF offline.
+
+    Run from the repository root with:  python -m benchmarks.bench_capture
+"""
+import glob
+import os
+import random
+import tempfile
+import time
+
+from chip8 import Emulator, NullDisplay, ScriptedKeypad
+from chip8.capture import CaptureDisplay, CaptureReader, gif_animation
+
+FRAMES = 3_000
+REPEATS = 3
+
+
+def run(rom: str, display) -> float:
+    keypad = ScriptedKeypad([(0, [5])])
+    keypad.set_frame(0)
+    emulator = Emulator(display=display, keypad=keypad, engine="table")
+    emulator.load_rom(rom)
+    started = time.perf_counter()
+    try:
+        for frame in range(FRAMES):
+            if isinstance(display, CaptureDisplay):
+                display.set_frame(frame)
+            emulator.run_frame()
+    except Exception:
+        pass
+    return time.perf_counter() - started
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "capture.c8v")
+        for rom in sorted(glob.glob("c8games/*")):
+            plain = []
+            captured = []
+            for _ in range(REPEATS):
+                plain.append(run(rom, NullDisplay()))
+                capture = CaptureDisplay(filename)
+                captured.append(run(rom, capture))
+                capture.close()
+            cost = max(min(captured) - min(plain), 0)
+
+            reader = CaptureReader(filename)
+            frames = len(reader)
+            started = time.perf_counter()
+            for _ in reader:
+                pass
+            sequential = time.perf_counter() - started
+            started = time.perf_counter()
+            for index in random.sample(range(frames), min(frames, 200)):
+                reader[index]
+            seek = (time.perf_counter() - started) / min(frames, 200)
+            started = time.perf_counter()
+            gif_animation(iter(reader), 4)
+            gif = time.perf_counter() - started
+
+            print(f"  {os.path.basename(rom):<10} {frames:>5} frames  {cost / FRAMES * 1e6:>6.1f} us/frame to capture"
+                  f"  {os.path.getsize(filename):>8,} bytes ({os.path.getsize(filename) / max(frames * 256, 1):>4.0%} of raw)"
+                  f"  read {sequential / max(frames, 1) * 1e6:>5.1f} us/frame  seek {seek * 1e6:>5.1f} us"
+                  f"  gif {gif / max(frames, 1) * 1e3:>5.2f} ms/frame")
+
+
+if __name__ == "__main__":
+    main()
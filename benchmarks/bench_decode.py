@@ -0,0 +1,112 @@
+"""
+    Microbenchmark for instruction decoding.
+
+    Compares building an OpCode object for every instruction,  as step() used to,  with the
+    nibbles found by dividing and flooring (the original OpCode) and with integer operations
+    (OpCode now),  against pulling the nibbles out of the 16 bit word with integer operations.
+    Then measures step() before and after:  the old one is made from step()'s source with the
+    decoding put back,  so only the decoding differs.  Lastly measures instructions per second
+    for each engine.
+
+    Run from the repository root with:  python -m benchmarks.bench_decode
+"""
+import inspect
+import math
+import re
+import sys
+import time
+
+from chip8 import ENGINE_NAMES, Machine, OpCode, interpreter, run
+
+ROM = "c8games/INVADERS"
+DECODES = 200_000
+INSTRUCTIONS = 100_000
+
+
+class FloorOpCode():
+    """
+        OpCode as it was originally,  splitting each byte into nibbles by dividing by 16.
+    """
+
+    def __init__(self, memory, program_counter):
+        self.msb = memory[program_counter]
+        self.lsb = memory[program_counter+1]
+        self.n0 = math.floor(self.msb / 16)
+        self.n1 = self.msb % 16
+        self.n2 = math.floor(self.lsb / 16)
+        self.n3 = self.lsb % 16
+
+
+def decode_with_floor_opcode(memory, addresses):
+    for program_counter in addresses:
+        opCode = FloorOpCode(memory, program_counter)
+        opCode.n0, opCode.n1, opCode.n2, opCode.n3
+
+
+def decode_with_opcode(memory, addresses):
+    for program_counter in addresses:
+        opCode = OpCode(memory, program_counter)
+        opCode.n0, opCode.n1, opCode.n2, opCode.n3
+
+
+def decode_with_integers(memory, addresses):
+    for program_counter in addresses:
+        op = (memory[program_counter] << 8) | memory[program_counter + 1]
+        op >> 12, (op >> 8) & 0xF, (op >> 4) & 0xF, op & 0xF
+
+
+def old_step():
+    """
+        step() as it was before,  with a FloorOpCode for every instruction and its fields
+        read wherever they're used rather than decoded into locals.
+    """
+    source = inspect.getsource(interpreter.step)
+    body = source.split("    n3 = lsb & 0xF\n", 1)[1]
+    body = re.sub(r"\b(msb|lsb|n0|n1|n2|n3)\b", r"opCode.\1", body)
+    source = ("def step(machine):\n"
+              "    opCode = FloorOpCode(machine.memory, machine.program_counter)\n" + body)
+    namespace = dict(vars(interpreter), FloorOpCode=FloorOpCode)
+    exec(source, namespace)
+    return namespace["step"]
+
+
+def load_machine(rom: str) -> Machine:
+    machine = Machine()
+    machine.load_rom(rom)
+    return machine
+
+
+def per_second(count: int, started: float) -> float:
+    return count / (time.perf_counter() - started)
+
+
+def main(rom: str):
+    machine = load_machine(rom)
+    rom_end = 0x200 + len(open(rom, "rb").read())
+    addresses = [0x200 + (i * 2) % (rom_end - 0x200) for i in range(DECODES)]
+
+    print(f"Decoding {DECODES} instructions from {rom}")
+    for name, decode in (("OpCode, floor", decode_with_floor_opcode), ("OpCode", decode_with_opcode),
+                         ("integer", decode_with_integers)):
+        started = time.perf_counter()
+        decode(machine.memory, addresses)
+        print(f"  {name:<14} {per_second(DECODES, started):>14,.0f} decodes/sec")
+
+    print(f"Running step() for {INSTRUCTIONS} instructions from {rom}")
+    for name, step in (("before", old_step()), ("after", interpreter.step)):
+        machine = load_machine(rom)
+        started = time.perf_counter()
+        for _ in range(INSTRUCTIONS):
+            step(machine)
+        print(f"  {name:<14} {per_second(INSTRUCTIONS, started):>14,.0f} instructions/sec")
+
+    print(f"Running {INSTRUCTIONS} instructions from {rom}")
+    for name in ENGINE_NAMES:
+        machine = load_machine(rom)
+        started = time.perf_counter()
+        executed = run(machine, name, INSTRUCTIONS)
+        print(f"  {name:<14} {per_second(executed, started):>14,.0f} instructions/sec")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else ROM)
@@ -0,0 +1,38 @@
+"""
+    Benchmark for the process farm.
+
+    Runs the same set of sessions (every bundled rom,  a few seeds each) with 1,  2,  4... processes
+    up to the number of cores,  and reports the speed up over a single process.
+
+    Run from the repository root with:  python -m benchmarks.bench_farm
+"""
+import glob
+import os
+import time
+
+from chip8.farm import FarmJob, run_farm
+
+SEEDS = 4
+CYCLES = 50_000
+
+
+def main():
+    jobs = [FarmJob(rom, seed, CYCLES) for rom in sorted(glob.glob("c8games/*")) for seed in range(SEEDS)]
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != os.cpu_count():
+        counts.append(os.cpu_count())
+
+    baseline = None
+    for processes in counts:
+        started = time.perf_counter()
+        total = sum(result.cycles for result in run_farm(jobs, processes))
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        print(f"  {processes:>3} processes {total / elapsed:>14,.0f} instructions/sec"
+              f" {len(jobs) / elapsed:>8,.1f} sessions/sec  x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
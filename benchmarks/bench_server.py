@@ -0,0 +1,163 @@
+"""
+    Benchmark for the network server.
+
+    Runs a server and its clients over loopback in one process,  with 1,  10,  100... sessions
+    of INVADERS each watched by one client,  and reports how close the sessions stay to 60
+    frames a second,  how many updates the clients get and how many bytes each takes.
+
+    Alongside them a stalled client joins a session of NOISE,  a little program which scribbles
+    random sprites over every row each frame so its frames don't compress,  and stops reading.
+    Its socket buffers are made as small as they go,  so its connection backs up within a
+    second or two.  The benchmark checks that the server then merges its frames rather than queueing
+    them without limit,  and that once it does read it ends up with the right display.
+
+    Lastly it checks that the server stops while a client is connected which never joined a
+    session.  Exits with an error if any check fails.
+
+    Run from the repository root with:  python -m benchmarks.bench_server
+"""
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+from chip8.client import Client
+from chip8.library import RomLibrary
+from chip8.scheduler import FRAME_RATE
+from chip8.server import WRITE_BUFFER_LIMIT, Server
+
+ROM = "INVADERS"
+SECONDS = 3
+
+NOISE = bytes([
+    0x6A, 0x00, 0x6B, 0x08, 0x6C, 0x10, 0x6D, 0x18,     # 200: VA..VD = 0,  8,  16,  24,  the rows to draw at
+    0xA3, 0x00,                                         # 208: I = 300
+    0xC0, 0xFF, 0xC1, 0xFF, 0xC2, 0xFF, 0xC3, 0xFF,     # 20A: V0..V6 = random
+    0xC4, 0xFF, 0xC5, 0xFF, 0xC6, 0xFF,
+    0xF6, 0x55,                                         # 218: store V0..V6 at I,  most of an 8 row sprite
+    0xC8, 0xFF, 0xD8, 0xA8, 0xC8, 0xFF, 0xD8, 0xB8,     # 21A: draw it at a random column over each
+    0xC8, 0xFF, 0xD8, 0xC8, 0xC8, 0xFF, 0xD8, 0xD8,     #      quarter of the screen
+    0x12, 0x0A,                                         # 22A: jump to 20A,  17 instructions a frame
+])
+
+
+async def watch(client: Client):
+    while True:
+        await client.receive_frame()
+
+
+async def stalled_client(port: int) -> Client:
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1)    # The kernel rounds up to its minimum
+    sock.connect(("127.0.0.1", port))
+    return Client(*await asyncio.open_connection(sock=sock))
+
+
+def stall(client: Client):
+    # Stop the event loop reading the socket too,  otherwise it buffers up to 64kB for us
+    client.writer.transport.pause_reading()
+
+
+async def measure(library: RomLibrary, sessions: int) -> bool:
+    server = Server(library)
+    listening = await server.start("127.0.0.1", 0)
+    port = listening.sockets[0].getsockname()[1]
+
+    clients = []
+    for number in range(sessions):
+        client = await Client.connect(port=port)
+        await client.join(f"session {number}", ROM)
+        await client.send_keys(1 << 5)
+        await client.receive_frame()    # The display as it was when we joined
+        clients.append(client)
+
+    stalled = await stalled_client(port)
+    await stalled.join("stalled", "NOISE")
+    while "stalled" not in server.sessions:
+        await asyncio.sleep(0.01)
+    stalled_session = server.sessions["stalled"]
+    stalled_subscriber = stalled_session.subscribers[0]
+    stalled_subscriber.writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1)
+    stall(stalled)
+
+    for client in clients:
+        client.frames_received = client.bytes_received = 0
+    watchers = [asyncio.ensure_future(watch(client)) for client in clients]
+    started = server.sessions["session 0"].frame
+    await asyncio.sleep(SECONDS)
+    frames = server.sessions["session 0"].frame - started
+    for watcher in watchers:
+        watcher.cancel()
+
+    updates = sum(client.frames_received for client in clients)
+    received = sum(client.bytes_received for client in clients)
+    stalled_frames = stalled_session.frame
+    sent = stalled_subscriber.frames_sent
+    queued = stalled_subscriber.writer.transport.get_write_buffer_size()
+    print(f"  {sessions:>5} sessions {frames / SECONDS:>6.1f} frames/sec"
+          f" {updates / SECONDS / sessions:>6.1f} updates/sec per client"
+          f" {received / max(updates, 1):>6.1f} bytes per update"
+          f"   stalled client sent {sent} of {stalled_frames} frames,  {queued:,} bytes queued")
+
+    # Stop the sessions,  then let the stalled client catch up with where its session ended
+    server.runner.cancel()
+    stalled.writer.transport.resume_reading()
+    try:
+        while stalled.frame != stalled_session.frame:
+            await asyncio.wait_for(stalled.receive_frame(), 5)
+        caught_up = stalled.display == stalled_session.emulator.machine.display
+    except asyncio.TimeoutError:
+        caught_up = False
+
+    for client in clients + [stalled]:
+        client.close()
+    await server.stop(listening)
+
+    problems = []
+    if sent >= stalled_frames:
+        problems.append("the stalled client's frames were never merged")
+    if queued > 2 * WRITE_BUFFER_LIMIT:
+        problems.append("too much is queued for the stalled client")
+    if not caught_up:
+        problems.append("the stalled client didn't end up with the session's display")
+    for problem in problems:
+        print(f"        {problem}")
+    return not problems
+
+
+async def stop_with_idle_client(library: RomLibrary) -> bool:
+    server = Server(library)
+    listening = await server.start("127.0.0.1", 0)
+    idle = await Client.connect(port=listening.sockets[0].getsockname()[1])
+    while not server.clients:
+        await asyncio.sleep(0.01)
+    try:
+        await asyncio.wait_for(server.stop(listening), 5)
+        stopped = True
+    except asyncio.TimeoutError:
+        stopped = False
+    idle.close()
+    print(f"  stopping with a client which never joined:  {'ok' if stopped else 'the server did not stop'}")
+    return stopped
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(os.path.join("c8games", ROM), directory)
+        with open(os.path.join(directory, "NOISE"), "wb") as f:
+            f.write(NOISE)
+        library = RomLibrary(directory)
+
+        print(f"{ROM},  {SECONDS} seconds each,  aiming for {FRAME_RATE} frames/sec")
+        passed = True
+        for sessions in (1, 10, 100, 250):
+            passed = await measure(library, sessions) and passed
+        passed = await stop_with_idle_client(library) and passed
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
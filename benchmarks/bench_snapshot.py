@@ -0,0 +1,60 @@
+"""
+    Benchmark for snapshots and rewind.
+
+    Plays INVADERS for a while,  then reports how many full snapshots can be saved and
+    restored per second,  and how fast and how big Rewind's per frame recordings are.
+
+    Run from the repository root with:  python -m benchmarks.bench_snapshot
+"""
+import time
+
+from chip8 import Machine, run_frame
+from chip8.snapshot import SNAPSHOT_SIZE, Rewind, load_snapshot, save_snapshot
+
+ROM = "c8games/INVADERS"
+COUNT = 20_000
+FRAMES = 2_000
+
+
+def per_second(count: int, started: float) -> float:
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    machine = Machine()
+    machine.load_rom(ROM)
+    machine.set_keys(1 << 5)
+    for frame in range(300):
+        run_frame(machine, "table", 1000)
+
+    started = time.perf_counter()
+    for _ in range(COUNT):
+        snapshot = save_snapshot(machine)
+    print(f"  save snapshot    {per_second(COUNT, started):>12,.0f} snapshots/sec  ({SNAPSHOT_SIZE} bytes each)")
+
+    started = time.perf_counter()
+    for _ in range(COUNT):
+        load_snapshot(machine, snapshot)
+    print(f"  load snapshot    {per_second(COUNT, started):>12,.0f} snapshots/sec")
+
+    rewind = Rewind(capacity=FRAMES)
+    recording = 0.0
+    for frame in range(FRAMES):
+        machine.set_keys(1 << (4 + frame // 100 % 3))
+        run_frame(machine, "table", 1000)
+        started = time.perf_counter()
+        rewind.record(machine)
+        recording = recording + time.perf_counter() - started
+    print(f"  rewind record    {FRAMES / recording:>12,.0f} snapshots/sec  "
+          f"({rewind.size() / len(rewind):,.0f} bytes each on average)")
+
+    steps = 0
+    started = time.perf_counter()
+    while len(rewind) > 1:
+        rewind.rewind(machine, 1)
+        steps = steps + 1
+    print(f"  rewind restore   {per_second(steps, started):>12,.0f} snapshots/sec")
+
+
+if __name__ == "__main__":
+    main()
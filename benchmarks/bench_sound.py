@@ -0,0 +1,144 @@
+"""
+    Checks that sound costs nothing while emulating.
+
+    The tone is started when the sound timer starts running and stopped when it runs out,
+    never touched per instruction.  Each little program below is run with a backend which
+    counts the calls to start() and stop(),  and checks they alternate,  and the counts are
+    compared with what the program does to the sound timer.  Exits with an error if they
+    don't match.
+
+    Then the held tone program is timed against the same program keeping the sound timer at
+    zero,  with NullSound and with WavFileSound,  interleaving the runs and comparing the
+    medians.  The timings are only reported,  they are too noisy to fail on.
+
+    Run from the repository root with:  python -m benchmarks.bench_sound
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from chip8 import Emulator, NullSound, Sound, WavFileSound
+
+FRAMES = 3_000
+REPEATS = 5
+HZ = 60_000
+
+
+def held(sound_timer: int) -> bytes:
+    # Sets the sound timer about a thousand times a frame
+    return bytes([
+        0x60, sound_timer,  # 200: V0 = sound_timer
+        0xF0, 0x18,         # 202: sound timer = V0
+        0x71, 0x01,         # 204: V1 += 1
+        0xA0, 0x00,         # 206: I = 0 (the font)
+        0xD1, 0x25,         # 208: draw at (V1, V2)
+        0x82, 0x14,         # 20A: V2 += V1
+        0x12, 0x02,         # 20C: jump to 202
+    ])
+
+
+ONE_TICK = bytes([
+    0x60, 0x01,             # 200: V0 = 1
+    0xF0, 0x18,             # 202: sound timer = V0,  the shortest beep there is
+    0x12, 0x04,             # 204: jump to 204
+])
+
+PULSES = bytes([
+    0x60, 0x02,             # 200: V0 = 2
+    0xF0, 0x18,             # 202: sound timer = V0,  on for two frames
+    0x61, 0x04,             # 204: V1 = 4
+    0xF1, 0x15,             # 206: delay timer = V1
+    0xF2, 0x07,             # 208: V2 = delay timer
+    0x32, 0x00,             # 20A: skip if V2 == 0
+    0x12, 0x08,             # 20C: jump to 208
+    0x12, 0x00,             # 20E: jump to 200,  every four frames
+])
+
+# Program,  instructions per second,  and the starts and stops expected over FRAMES frames
+CASES = [
+    ("held", held(0xFF), HZ, 1, 0),
+    ("silent", held(0), HZ, 0, 0),
+    ("one tick", ONE_TICK, 1000, 1, 1),
+    ("pulses", PULSES, 1000, FRAMES // 4, FRAMES // 4),
+]
+
+
+class CountingSound(Sound):
+    def __init__(self, sound: Sound):
+        self.sound = sound
+        self.starts = 0
+        self.stops = 0
+        self.frames = 0
+        self.playing = False
+        self.out_of_turn = 0    # start() while playing or stop() while not
+
+    def start(self):
+        if self.playing:
+            self.out_of_turn = self.out_of_turn + 1
+        self.playing = True
+        self.starts = self.starts + 1
+        self.sound.start()
+
+    def stop(self):
+        if not self.playing:
+            self.out_of_turn = self.out_of_turn + 1
+        self.playing = False
+        self.stops = self.stops + 1
+        self.sound.stop()
+
+    def frame(self):
+        self.frames = self.frames + 1
+        self.sound.frame()
+
+
+def emulate(program: bytes, hz: int, sound: Sound) -> float:
+    emulator = Emulator(sound=sound, engine="table", hz=hz)
+    emulator.load_program(program)
+    started = time.perf_counter()
+    for _ in range(FRAMES):
+        emulator.run_frame()
+    return emulator.machine.cycles / (time.perf_counter() - started)
+
+
+def check_calls() -> bool:
+    passed = True
+    for name, program, hz, starts, stops in CASES:
+        sound = CountingSound(NullSound())
+        emulate(program, hz, sound)
+        ok = (sound.starts, sound.stops, sound.frames, sound.out_of_turn) == (starts, stops, FRAMES, 0)
+        print(f"  {name:<10} started {sound.starts:>4} stopped {sound.stops:>4} (expected {starts} and {stops})"
+              f"  {sound.out_of_turn} out of turn  {'ok' if ok else 'WRONG'}")
+        passed = passed and ok
+    return passed
+
+
+def compare_speeds(directory: str):
+    for name, make in (("null", NullSound), ("wav file", lambda: WavFileSound(os.path.join(directory, "out.wav")))):
+        silent = []
+        playing = []
+        for _ in range(REPEATS):
+            for sound_timer, speeds in ((0, silent), (0xFF, playing)):
+                sound = make()
+                speeds.append(emulate(held(sound_timer), HZ, sound))
+                if isinstance(sound, WavFileSound):
+                    sound.close()
+        silent = statistics.median(silent)
+        playing = statistics.median(playing)
+        print(f"  {name:<10} silent {silent:>12,.0f}  playing {playing:>12,.0f} instructions/sec"
+              f"  {100 * (playing / silent - 1):+.1f}%")
+
+
+def main():
+    print(f"Calls to the sound backend over {FRAMES} frames")
+    passed = check_calls()
+    print(f"Medians of {REPEATS} interleaved runs")
+    with tempfile.TemporaryDirectory() as directory:
+        compare_speeds(directory)
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
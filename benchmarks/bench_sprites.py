@@ -0,0 +1,65 @@
+"""
+    Benchmark for DXYN sprite drawing.
+
+    Compares the original framebuffer (32 lists of 64 bools,  drawn a pixel at a time)
+    against the packed framebuffer (one 64 bit int per row) used by draw_sprite().
+
+    Run from the repository root with:  python -m benchmarks.bench_sprites
+"""
+import random
+import time
+
+from chip8 import Machine, draw_sprite
+
+SPRITES = 100_000
+
+
+def draw_sprite_bool_grid(machine: Machine, vX: int, vY: int, N: int):
+    # How DXYN used to draw,  kept here as the baseline to measure against
+    machine.registers[0xF] = 0
+    masks = [0b10000000, 0b01000000, 0b00100000, 0b00010000,
+             0b00001000, 0b00000100, 0b00000010, 0b00000001]
+    for row in range(0, N):
+        bit_map = machine.memory[machine.I + row]
+
+        for column in range(0, 8):
+            mask = masks[column]
+            bit = (mask & bit_map) == mask
+            current = machine.display[(row + vY) % 32][(column + vX) % 64]
+            new_value = current ^ bit
+
+            if current and not new_value:
+                machine.registers[0xF] = 1
+
+            machine.display[(row + vY) % 32][(column + vX) % 64] = new_value
+
+
+def main():
+    rng = random.Random(1)
+    # (I, x, y, rows) for each draw.  Sprites come from the font and the rom area.
+    draws = [(rng.randrange(0, 0x300), rng.randrange(256), rng.randrange(256), rng.randrange(1, 16))
+             for _ in range(SPRITES)]
+
+    results = {}
+    for name, draw, display in (("bool grid", draw_sprite_bool_grid, lambda: [[False]*64 for _ in range(32)]),
+                                ("packed rows", draw_sprite, lambda: [0] * 32)):
+        machine = Machine()
+        machine.load_rom("c8games/INVADERS")
+        machine.display = display()
+
+        collisions = 0
+        started = time.perf_counter()
+        for I, x, y, rows in draws:
+            machine.I = I
+            draw(machine, x, y, rows)
+            collisions = collisions + machine.registers[0xF]
+        elapsed = time.perf_counter() - started
+        results[name] = collisions
+        print(f"  {name:<12} {SPRITES / elapsed:>12,.0f} sprites/sec  ({collisions} collisions)")
+
+    if results["bool grid"] != results["packed rows"]:
+        raise SystemExit("Collision counts differ between the two framebuffers")
+
+
+if __name__ == "__main__":
+    main()
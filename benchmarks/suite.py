@@ -0,0 +1,158 @@
+"""
+    Benchmark suite.
+
+    Runs every rom in c8games headless for a fixed number of instructions with each engine,
+    pressing keys from the scripts in benchmarks/inputs.json and with the random numbers
+    for CXNN seeded,  so every run of a rom does exactly the same work.  For each rom it
+    reports instructions and frames per second,  the peak memory allocated while running
+    (measured in a second,  traced,  run) and a hash of the final display.
+
+    Results can be saved as a baseline and later runs compared against it.  A display hash
+    which differs from the baseline is a correctness regression and fails the run,  a speed
+    more than --tolerance below the baseline is reported as slower.
+
+        python -m benchmarks.suite                     compare against benchmarks/baseline.json
+        python -m benchmarks.suite --save              write a new baseline
+        python -m benchmarks.suite --engine table --rom PONG --rom BRIX
+
+    A script recorded with main.py --record-input can be added to inputs.json under the rom's
+    name.  Record at a fixed --hz,  or the frames won't line up when replayed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from chip8 import DEFAULT_HZ, ENGINE_NAMES, Emulator, ScriptedKeypad, display_hash, instructions_per_frame
+from chip8.library import RomLibrary
+
+ROM_DIRECTORY = "c8games"
+INPUTS = "benchmarks/inputs.json"
+BASELINE = "benchmarks/baseline.json"
+INSTRUCTIONS = 100_000
+SEED = 8
+
+
+def expand_script(inputs: dict, frames: int) -> List[Tuple[int, List[int]]]:
+    """
+        Repeats a script with a period until it covers the given number of frames.
+    """
+    script = inputs["script"]
+    period = inputs.get("period")
+    if not period:
+        return script
+    expanded = []
+    for start in range(0, frames, period):
+        expanded.extend((start + frame, keys) for frame, keys in script if frame < period)
+    return expanded
+
+
+def play(library: RomLibrary, rom: str, engine: str, script, instructions: int) -> dict:
+    random.seed(SEED)
+    keypad = ScriptedKeypad(script)
+    emulator = Emulator(keypad=keypad, engine=engine, hz=DEFAULT_HZ)
+    emulator.load_program(library.program(rom))
+
+    error = None
+    frames = 0
+    started = time.perf_counter()
+    try:
+        while emulator.machine.cycles + emulator.machine.idle_cycles < instructions:
+            keypad.set_frame(frames)
+            emulator.run_frame()
+            frames = frames + 1
+    except Exception as e:
+        error = repr(e)
+    elapsed = time.perf_counter() - started
+
+    return {"instructions": emulator.machine.cycles,
+            "frames": frames,
+            "instructions_per_second": round(emulator.machine.cycles / elapsed),
+            "frames_per_second": round(frames / elapsed, 1),
+            "display_hash": display_hash(emulator.machine),
+            "error": error}
+
+
+def peak_memory(library: RomLibrary, rom: str, engine: str, script, instructions: int) -> int:
+    tracemalloc.start()
+    play(library, rom, engine, script, instructions)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    problems = []
+    if result["display_hash"] != baseline["display_hash"] or result["error"] != baseline["error"]:
+        problems.append("CHANGED")
+    if result["instructions_per_second"] < baseline["instructions_per_second"] * (1 - tolerance):
+        problems.append(f"SLOWER (was {baseline['instructions_per_second']:,})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark over the bundled roms")
+    parser.add_argument("--engine", action="append", choices=ENGINE_NAMES,
+                        help="engine to run,  may be repeated (default all)")
+    parser.add_argument("--rom", action="append", help="rom to run,  may be repeated (default all)")
+    parser.add_argument("--instructions", type=int, default=INSTRUCTIONS)
+    parser.add_argument("--save", action="store_true", help=f"save the results as {BASELINE}")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run for peak memory")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction below the baseline speed to allow before reporting slower")
+    args = parser.parse_args()
+
+    library = RomLibrary(ROM_DIRECTORY)
+    with open(INPUTS) as f:
+        inputs = json.load(f)
+
+    baseline = None
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        if baseline["instructions"] != args.instructions or baseline["seed"] != SEED:
+            print(f"{BASELINE} was made with a different number of instructions or seed,  not comparing")
+            baseline = None
+
+    frames = args.instructions // instructions_per_frame(DEFAULT_HZ) + 1
+    results = {}
+    changed = False
+    for engine in args.engine or ENGINE_NAMES:
+        print(engine)
+        results[engine] = {}
+        for rom in args.rom or library.names():
+            script = expand_script(inputs.get(rom, inputs["default"]), frames)
+            result = play(library, rom, engine, script, args.instructions)
+            if not args.no_memory:
+                result["peak_memory"] = peak_memory(library, rom, engine, script, args.instructions)
+            results[engine][rom] = result
+
+            problems = []
+            if baseline and rom in baseline["results"].get(engine, {}):
+                problems = compare(result, baseline["results"][engine][rom], args.tolerance)
+                changed = changed or "CHANGED" in problems
+            memory = f"{result['peak_memory'] / 1024:>8,.0f} KiB" if "peak_memory" in result else ""
+            print(f"  {rom:<10} {result['instructions_per_second']:>12,} instructions/sec"
+                  f" {result['frames_per_second']:>10,.0f} frames/sec {memory}"
+                  f"  {result['display_hash'][:12]}  {result['error'] or ''} {' '.join(problems)}")
+
+    if args.save:
+        # Roms and engines which weren't run this time keep their old results
+        saved = baseline["results"] if baseline else {}
+        for engine in results:
+            saved.setdefault(engine, {}).update(results[engine])
+        with open(BASELINE, "w") as f:
+            json.dump({"instructions": args.instructions, "seed": SEED, "results": saved}, f, indent=1)
+        print(f"Saved {BASELINE}")
+
+    if changed:
+        print("The display or outcome of some roms changed since the baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+"""
+    A headless CHIP-8 core.  Nothing in this package needs pygame or winsound,
+    see main.py for the interactive front end.
+"""
+from .backends import (Display, Keypad, NullDisplay, NullKeypad, NullSound, RecordingKeypad, ScriptedKeypad,
+                       Sound, WavFileSound, square_wave)
+from .emulator import Emulator
+from .font import load_fonts
+from .interpreter import step
+from .machine import Machine, OpCode, display_hash, display_screen, draw_sprite, pixel
+from .scheduler import (DEFAULT_HZ, ENGINE_NAMES, ENGINES, FRAME_RATE, instructions_per_frame, run,
+                        run_frame, run_frame_instructions)
@@ -0,0 +1,333 @@
+"""
+    Static rom analyser.
+
+    Walks a program from its entry point without running it,  following every path an
+    instruction could take:  jumps to their target,  calls to the subroutine and on to the
+    return address,  skips to both the next instruction and the one after.  Instructions are
+    decoded with the DISPATCH_TABLE,  so they mean exactly what they mean to step().
+
+    The value of I is tracked along the way where it is a constant (set by ANNN and not yet
+    moved by FX1E),  so the bytes a DXYN draws are marked as sprite data and the bytes FX33,
+    FX55 and FX65 store and load are marked as data.
+
+    The result is:
+
+        + every reachable instruction,  and the basic blocks they form with their successors
+          (the control flow graph),  which subroutines are called and from where
+        + a kind for every address:  instruction,  second byte of an instruction,  sprite,
+          data or not reached
+        + BNNN computed jumps,  whose targets depend on V0 and are not followed,  and any
+          reachable opcodes step() doesn't know
+
+    disassemble() lists it all,  index() is the same as json.
+
+        python -m chip8.analyser c8games/* --out listings
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+from .dispatch import (DISPATCH_TABLE, op_add, op_add_index, op_add_registers, op_and, op_assign, op_bcd,
+                       op_call, op_clear_screen, op_draw, op_font, op_get_delay_timer, op_jump,
+                       op_jump_offset, op_load, op_or, op_random, op_return, op_set, op_set_delay_timer,
+                       op_set_index, op_set_sound_timer, op_shift_left, op_shift_right, op_skip_if_equal,
+                       op_skip_if_key, op_skip_if_not_equal, op_skip_if_not_key, op_skip_if_registers_equal,
+                       op_skip_if_registers_not_equal, op_store, op_subtract, op_subtract_reversed,
+                       op_unknown, op_wait_for_key, op_xor)
+from .machine import Machine, address
+
+UNREACHED = 0
+INSTRUCTION = 1
+OPERAND = 2     # The second byte of an instruction
+SPRITE = 3
+DATA = 4
+KIND_LETTERS = ".IiSD"
+
+UNKNOWN = -1    # I isn't a constant here
+
+MNEMONICS = {
+    op_clear_screen: "CLS",
+    op_return: "RET",
+    op_jump: "JP   {nnn:03X}",
+    op_call: "CALL {nnn:03X}",
+    op_skip_if_equal: "SE   V{x:X}, {nn:02X}",
+    op_skip_if_not_equal: "SNE  V{x:X}, {nn:02X}",
+    op_skip_if_registers_equal: "SE   V{x:X}, V{y:X}",
+    op_set: "LD   V{x:X}, {nn:02X}",
+    op_add: "ADD  V{x:X}, {nn:02X}",
+    op_assign: "LD   V{x:X}, V{y:X}",
+    op_or: "OR   V{x:X}, V{y:X}",
+    op_and: "AND  V{x:X}, V{y:X}",
+    op_xor: "XOR  V{x:X}, V{y:X}",
+    op_add_registers: "ADD  V{x:X}, V{y:X}",
+    op_subtract: "SUB  V{x:X}, V{y:X}",
+    op_shift_right: "SHR  V{x:X}",
+    op_subtract_reversed: "SUBN V{x:X}, V{y:X}",
+    op_shift_left: "SHL  V{x:X}",
+    op_skip_if_registers_not_equal: "SNE  V{x:X}, V{y:X}",
+    op_set_index: "LD   I, {nnn:03X}",
+    op_jump_offset: "JP   V0, {nnn:03X}",
+    op_random: "RND  V{x:X}, {nn:02X}",
+    op_draw: "DRW  V{x:X}, V{y:X}, {n:X}",
+    op_skip_if_key: "SKP  V{x:X}",
+    op_skip_if_not_key: "SKNP V{x:X}",
+    op_get_delay_timer: "LD   V{x:X}, DT",
+    op_wait_for_key: "LD   V{x:X}, K",
+    op_set_delay_timer: "LD   DT, V{x:X}",
+    op_set_sound_timer: "LD   ST, V{x:X}",
+    op_add_index: "ADD  I, V{x:X}",
+    op_font: "LD   F, V{x:X}",
+    op_bcd: "LD   B, V{x:X}",
+    op_store: "LD   [I], V{x:X}",
+    op_load: "LD   V{x:X}, [I]",
+    op_unknown: "???",
+}
+
+SKIPS = {op_skip_if_equal, op_skip_if_not_equal, op_skip_if_registers_equal, op_skip_if_registers_not_equal,
+         op_skip_if_key, op_skip_if_not_key}
+# Instructions after which control doesn't simply carry on to the next one
+BRANCHES = SKIPS | {op_jump, op_call, op_return, op_jump_offset, op_unknown}
+
+
+def mnemonic(op: int) -> str:
+    return MNEMONICS[DISPATCH_TABLE[op]].format(x=(op >> 8) & 0xF, y=(op >> 4) & 0xF, n=op & 0xF,
+                                                nn=op & 0xFF, nnn=op & 0xFFF)
+
+
+def successors(address: address, op: int) -> List[address]:
+    """
+        Where control can go after the instruction at address.  Calls go to the subroutine
+        and (once it returns) the next instruction.  Returns,  computed jumps and unknown
+        opcodes have none we can know.
+    """
+    handler = DISPATCH_TABLE[op]
+    if handler is op_jump:
+        return [op & 0xFFF]
+    if handler is op_call:
+        return [op & 0xFFF, address + 2]
+    if handler in SKIPS:
+        return [address + 2, address + 4]
+    if handler is op_return or handler is op_jump_offset or handler is op_unknown:
+        return []
+    return [address + 2]
+
+
+class BasicBlock:
+    def __init__(self, start: address):
+        self.start = start
+        self.end = start        # Address after the last instruction
+        self.successors: List[address] = []
+        self.calls = None       # The subroutine called by the last instruction,  if it's a call
+
+    def to_json(self) -> dict:
+        return {"start": self.start, "end": self.end, "successors": self.successors, "calls": self.calls}
+
+
+class Analysis:
+    def __init__(self, entry: address, end: address):
+        self.entry = entry
+        self.end = end          # Address after the last byte of the program
+        self.instructions: Dict[address, int] = {}
+        self.kinds = bytearray(4096)
+        self.blocks: Dict[address, BasicBlock] = {}
+        self.block_starts = [None] * 4096    # The start of the block each instruction is in
+        self.subroutines: Dict[address, List[address]] = {}    # subroutine -> where it is called from
+        self.computed_jumps: List[address] = []
+        self.unknown_opcodes: List[address] = []
+        self.overlaps: List[address] = []    # Data which is also run as code
+
+    def _mark_data(self, start: int, length: int, kind: int):
+        kinds = self.kinds
+        for data_address in range(start, min(start + length, 4096)):
+            if kinds[data_address] == INSTRUCTION or kinds[data_address] == OPERAND:
+                if data_address not in self.overlaps:
+                    self.overlaps.append(data_address)
+            elif kinds[data_address] != SPRITE:
+                kinds[data_address] = kind
+
+    def index(self) -> dict:
+        return {"entry": self.entry,
+                "end": self.end,
+                "kinds": "".join(KIND_LETTERS[kind] for kind in self.kinds[0x200:self.end]),
+                "blocks": [self.blocks[start].to_json() for start in sorted(self.blocks)],
+                "subroutines": [{"start": start, "callers": callers} for start, callers in sorted(self.subroutines.items())],
+                "computed_jumps": self.computed_jumps,
+                "unknown_opcodes": self.unknown_opcodes,
+                "overlaps": self.overlaps}
+
+
+def analyse(machine: Machine, end: address = 4096, entry: address = 0x200) -> Analysis:
+    """
+        Analyses the program in the machine's memory,  which ends before end (load_rom puts
+        a rom of n bytes at 0x200,  so it ends at 0x200 + n).
+    """
+    memory = machine.memory
+    analysis = Analysis(entry, end)
+    instructions = analysis.instructions
+    kinds = analysis.kinds
+    data = []           # (address,  length,  kind) read or written through I
+
+    # Each instruction is visited with the value I has when it is reached,  and again (at most
+    # once) if it can also be reached with a different value,  after which I is UNKNOWN there.
+    I_at = {}
+    work = [(entry, UNKNOWN)]
+    while work:
+        program_counter, I = work.pop()
+        if program_counter + 1 >= 4096:
+            continue
+        seen = I_at.get(program_counter)
+        if seen is not None:
+            if seen == I or seen == UNKNOWN:
+                continue
+            I = UNKNOWN
+        I_at[program_counter] = I
+
+        op = (memory[program_counter] << 8) | memory[program_counter + 1]
+        handler = DISPATCH_TABLE[op]
+        if program_counter not in instructions:
+            instructions[program_counter] = op
+            kinds[program_counter] = INSTRUCTION
+            kinds[program_counter + 1] = OPERAND
+            if handler is op_jump_offset:
+                analysis.computed_jumps.append(program_counter)
+            elif handler is op_unknown:
+                analysis.unknown_opcodes.append(program_counter)
+            elif handler is op_call:
+                analysis.subroutines.setdefault(op & 0xFFF, []).append(program_counter)
+
+        if handler is op_set_index:
+            I = op & 0xFFF
+        elif handler is op_add_index or handler is op_font:
+            I = UNKNOWN
+        elif I != UNKNOWN:
+            if handler is op_draw:
+                data.append((I, op & 0xF, SPRITE))
+            elif handler is op_bcd:
+                data.append((I, 3, DATA))
+            elif handler is op_store or handler is op_load:
+                data.append((I, ((op >> 8) & 0xF) + 1, DATA))
+
+        following = successors(program_counter, op)
+        if handler is op_call:
+            # The subroutine starts with our I,  but we can't know what it leaves behind
+            work.append((following[0], I))
+            work.append((following[1], UNKNOWN))
+        else:
+            work.extend((successor, I) for successor in following)
+
+    # Data goes in after all the code is known,  so code always wins
+    for start, length, kind in data:
+        analysis._mark_data(start, length, kind)
+    analysis.computed_jumps.sort()
+    analysis.unknown_opcodes.sort()
+    analysis.overlaps.sort()
+
+    _build_blocks(analysis)
+    return analysis
+
+
+def _build_blocks(analysis: Analysis):
+    instructions = analysis.instructions
+    leaders = {analysis.entry}
+    for instruction_address, op in instructions.items():
+        if DISPATCH_TABLE[op] in BRANCHES:
+            leaders.update(successor for successor in successors(instruction_address, op)
+                           if successor in instructions)
+
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+        block = analysis.blocks[start] = BasicBlock(start)
+        program_counter = start
+        while True:
+            op = instructions[program_counter]
+            analysis.block_starts[program_counter] = start
+            following = successors(program_counter, op)
+            program_counter = program_counter + 2
+            if DISPATCH_TABLE[op] in BRANCHES:
+                if DISPATCH_TABLE[op] is op_call:
+                    block.calls = following[0]
+                    following = following[1:]
+                block.successors = following
+                break
+            if program_counter in leaders or program_counter not in instructions:
+                block.successors = following
+                break
+        block.end = program_counter
+
+
+def _sprite_row(value: int) -> str:
+    return format(value, "08b").replace("0", ".").replace("1", "#")
+
+
+def disassemble(machine: Machine, analysis: Analysis) -> List[str]:
+    """
+        A listing of the program,  one line per instruction or data byte,  with labels for
+        subroutines and blocks.  Bytes which were never reached are listed 8 to a line.
+    """
+    memory = machine.memory
+    kinds = analysis.kinds
+    lines = [f"; entry {analysis.entry:03X},  {len(analysis.instructions)} instructions in "
+             f"{len(analysis.blocks)} blocks,  {len(analysis.subroutines)} subroutines"]
+    for computed in analysis.computed_jumps:
+        lines.append(f"; computed jump at {computed:03X}")
+    for unknown in analysis.unknown_opcodes:
+        lines.append(f"; unknown opcode at {unknown:03X}")
+
+    listing_address = analysis.entry
+    while listing_address < analysis.end:
+        kind = kinds[listing_address]
+        if kind == INSTRUCTION:
+            if listing_address in analysis.subroutines:
+                lines.append(f"sub_{listing_address:03X}:")
+            elif listing_address in analysis.blocks:
+                lines.append(f"L_{listing_address:03X}:")
+            op = analysis.instructions[listing_address]
+            lines.append(f"    {listing_address:03X}  {op:04X}  {mnemonic(op)}")
+            listing_address = listing_address + 2
+        elif kind == SPRITE or kind == DATA:
+            value = memory[listing_address]
+            comment = _sprite_row(value) if kind == SPRITE else "data"
+            lines.append(f"    {listing_address:03X}  {value:02X}    .byte {value:02X}       ; {comment}")
+            listing_address = listing_address + 1
+        else:
+            run = listing_address
+            while run < analysis.end and run < listing_address + 8 and kinds[run] in (UNREACHED, OPERAND):
+                run = run + 1
+            run = max(run, listing_address + 1)
+            values = " ".join(f"{memory[a]:02X}" for a in range(listing_address, run))
+            lines.append(f"    {listing_address:03X}        .byte {values}")
+            listing_address = run
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Disassemble roms and index their code and data")
+    parser.add_argument("roms", nargs="+")
+    parser.add_argument("--out", metavar="DIRECTORY", help="write NAME.asm and NAME.json for each rom here")
+    args = parser.parse_args()
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    started = time.perf_counter()
+    for rom in args.roms:
+        machine = Machine()
+        machine.load_rom(rom)
+        result = analyse(machine, 0x200 + os.path.getsize(rom))
+        sprites = result.kinds.count(SPRITE)
+        flags = ""
+        if result.computed_jumps:
+            flags = flags + f"  computed jumps at {' '.join(f'{a:03X}' for a in result.computed_jumps)}"
+        if result.unknown_opcodes:
+            flags = flags + f"  unknown opcodes at {' '.join(f'{a:03X}' for a in result.unknown_opcodes)}"
+        print(f"{os.path.basename(rom):<10} {len(result.instructions):>5} instructions {len(result.blocks):>4} blocks"
+              f" {len(result.subroutines):>3} subroutines {sprites:>5} sprite bytes{flags}")
+        if args.out:
+            name = os.path.join(args.out, os.path.basename(rom))
+            with open(name + ".asm", "w") as f:
+                f.write("\n".join(disassemble(machine, result)) + "\n")
+            with open(name + ".json", "w") as f:
+                json.dump(result.index(), f)
+    print(f"{len(args.roms)} roms in {time.perf_counter() - started:.3f}s")
@@ -0,0 +1,169 @@
+"""
+    Display,  keypad and sound backends.
+
+    The core never talks to a window,  keyboard or speaker itself.  An Emulator is given
+    one backend of each kind and calls:
+
+        display.present(machine)    after a frame in which the display changed
+        keypad.key_state()          before each frame
+        sound.start(),  sound.stop() when the sound timer starts running and runs out
+        sound.frame()               after every frame
+
+    None of these may block.  A sound backend plays its tone in the background (or,  like
+    WavFileSound,  records a frame's worth of audio in frame()).
+
+    The Null backends do nothing,  for running headless.
+"""
+import wave
+from typing import Iterable, List, Tuple
+
+from .machine import Machine
+from .scheduler import FRAME_RATE
+
+
+def keys_to_state(keys: Iterable[int]) -> int:
+    state = 0
+    for key in keys:
+        state = state | (1 << key)
+    return state
+
+
+class Display:
+    def present(self, machine: Machine):
+        raise NotImplementedError
+
+
+class Keypad:
+    def key_state(self) -> int:
+        """
+            Which of the 16 keys (0x0->0xF) are down,  bit n is set while key n is down.
+        """
+        raise NotImplementedError
+
+
+class Sound:
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def frame(self):
+        pass
+
+
+class NullDisplay(Display):
+    def present(self, machine: Machine):
+        pass
+
+
+class NullKeypad(Keypad):
+    def key_state(self) -> int:
+        return 0
+
+
+class NullSound(Sound):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class ScriptedKeypad(Keypad):
+    """
+        Replays a script of (frame, keys) pairs.  From the given frame onwards exactly the
+        listed keys are held down,  until the next entry in the script.
+        Call set_frame() before running each frame.
+    """
+
+    def __init__(self, script: Iterable[Tuple[int, Iterable[int]]]):
+        self.script: List[Tuple[int, Iterable[int]]] = sorted(script, key=lambda entry: entry[0])
+        self.position = 0
+        self.state = 0
+
+    def set_frame(self, frame: int):
+        while self.position < len(self.script) and self.script[self.position][0] <= frame:
+            self.state = keys_to_state(self.script[self.position][1])
+            self.position = self.position + 1
+
+    def key_state(self) -> int:
+        return self.state
+
+
+class RecordingKeypad(Keypad):
+    """
+        Passes key presses through from another keypad and records them as a script which
+        ScriptedKeypad can replay.  Call set_frame() before running each frame.
+    """
+
+    def __init__(self, keypad: Keypad):
+        self.keypad = keypad
+        self.script: List[Tuple[int, List[int]]] = []
+        self.state = 0
+
+    def set_frame(self, frame: int):
+        state = self.keypad.key_state()
+        if state != self.state or not self.script:
+            self.script.append((frame, [key for key in range(0x10) if (state >> key) & 1]))
+            self.state = state
+
+    def key_state(self) -> int:
+        return self.keypad.key_state()
+
+
+TONE_FREQUENCY = 500
+SAMPLE_RATE = 44100
+
+
+def square_wave(frequency: int = TONE_FREQUENCY, sample_rate: int = SAMPLE_RATE, sample_width: int = 1,
+                volume: float = 0.25) -> bytes:
+    """
+        One second of a square wave as mono PCM samples,  unsigned 8 bit or signed 16 bit
+        little endian.  A whole number of cycles fits in a second,  so it loops without a click.
+    """
+    if sample_width == 1:
+        high, low = bytes([round(0x80 + 0x7F * volume)]), bytes([round(0x80 - 0x7F * volume)])
+    else:
+        high = round(0x7FFF * volume).to_bytes(2, "little", signed=True)
+        low = round(-0x7FFF * volume).to_bytes(2, "little", signed=True)
+    return b"".join(high if (i * frequency * 2 // sample_rate) % 2 == 0 else low for i in range(sample_rate))
+
+
+class WavFileSound(Sound):
+    """
+        Writes what would have been heard to a WAV file,  1/60th of a second for every frame,
+        for listening to headless runs.  Call close() at the end to finish the file.
+    """
+
+    def __init__(self, filename: str):
+        self.file = wave.open(filename, "wb")
+        self.file.setnchannels(1)
+        self.file.setsampwidth(1)
+        self.file.setframerate(SAMPLE_RATE)
+        self.tone = square_wave()
+        self.samples_per_frame = SAMPLE_RATE // FRAME_RATE
+        self.silence = b"\x80" * self.samples_per_frame
+        self.position = 0   # where we are in the tone,  so it carries on smoothly from frame to frame
+        self.playing = False
+
+    def start(self):
+        self.playing = True
+
+    def stop(self):
+        self.playing = False
+
+    def frame(self):
+        if not self.playing:
+            self.file.writeframesraw(self.silence)
+            return
+        end = self.position + self.samples_per_frame
+        samples = self.tone[self.position:end]
+        if end > len(self.tone):
+            end = end - len(self.tone)
+            samples = samples + self.tone[:end]
+        self.file.writeframesraw(samples)
+        self.position = end
+
+    def close(self):
+        self.file.close()
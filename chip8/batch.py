@@ -0,0 +1,506 @@
+"""
+    Batched engine.
+
+    Runs many machines in lockstep with their state held in NumPy arrays,  one row per
+    machine.  Each step decodes every machine's next instruction,  groups the machines by
+    the handler the DISPATCH_TABLE picks for it,  and runs each group as a handful of
+    vectorised array operations.
+
+    The results match running step() on each machine on its own.  A machine which would
+    have raised in step() (unknown opcode,  stack overflow,  reading past the end of
+    memory...) is halted instead,  and the reason is kept in errors.  As in scheduler.run(),
+    a machine parked by FX0A runs nothing more until a key is down,  and the instructions it
+    spends waiting are counted in idle_cycles rather than cycles.
+
+    This module needs NumPy,  which the rest of the package does not.
+"""
+import random
+from array import array
+from typing import List
+
+import numpy as np
+
+from .dispatch import (DISPATCH_TABLE, op_add, op_add_index, op_add_registers, op_and, op_assign, op_bcd,
+                       op_call, op_clear_screen, op_draw, op_font, op_get_delay_timer, op_jump,
+                       op_jump_offset, op_load, op_or, op_random, op_return, op_set, op_set_delay_timer,
+                       op_set_index, op_set_sound_timer, op_shift_left, op_shift_right, op_skip_if_equal,
+                       op_skip_if_key, op_skip_if_not_equal, op_skip_if_not_key,
+                       op_skip_if_registers_equal, op_skip_if_registers_not_equal, op_store, op_subtract,
+                       op_subtract_reversed, op_unknown, op_wait_for_key, op_xor)
+from .machine import Machine, boot_image, mapped_rom
+from .scheduler import DEFAULT_HZ, instructions_per_frame
+
+MEMORY_SIZE = 4096
+STACK_SIZE = 16
+
+
+class BatchMachine:
+    def __init__(self, count: int, seeds: List[int] = None):
+        self.count = count
+        # Bytes,  as in a Machine,  widened where they're used in arithmetic
+        self.memory = np.zeros((count, MEMORY_SIZE), dtype=np.uint8)
+        self.registers = np.zeros((count, 0x10), dtype=np.int32)
+        self.stack = np.zeros((count, STACK_SIZE), dtype=np.int64)
+        self.stack_pointer = np.zeros(count, dtype=np.int64)
+        self.program_counter = np.zeros(count, dtype=np.int64)
+        self.I = np.zeros(count, dtype=np.int64)
+        self.display = np.zeros((count, 32), dtype=np.uint64)
+        self.display_dirty = np.zeros(count, dtype=bool)
+        self.delay_timer = np.zeros(count, dtype=np.int64)
+        self.sound_timer = np.zeros(count, dtype=np.int64)
+        self.keys = np.zeros((count, 0x10), dtype=bool)     # Set by the caller,  True while a key is down
+        self.waiting_for_key = np.zeros(count, dtype=bool)
+        self.halted = np.zeros(count, dtype=bool)
+        self.errors = [None] * count
+        self.cycles = np.zeros(count, dtype=np.int64)       # Instructions each machine executed
+        self.idle_cycles = np.zeros(count, dtype=np.int64)  # and spent parked in FX0A
+        # CXNN draws from a separate generator per machine,  so a machine's random numbers
+        # don't depend on what the others are doing.
+        seeds = seeds if seeds is not None else range(count)
+        self.random = [random.Random(seed) for seed in seeds]
+
+    def load_rom(self, filename: str, machines=slice(None)):
+        with mapped_rom(filename) as rom:
+            image = boot_image(rom)
+        self.memory[machines] = np.frombuffer(image, dtype=np.uint8)
+        self.program_counter[machines] = 0x200
+
+    def halt(self, machines: np.ndarray, message: str):
+        self.halted[machines] = True
+        for i in machines:
+            self.errors[i] = message
+
+    def step(self) -> np.ndarray:
+        """
+            Runs an instruction on every machine which isn't halted or waiting for a key,  and
+            returns a mask of the machines which executed one.
+        """
+        self.waiting_for_key &= ~self.keys.any(axis=1)
+        executing = ~self.halted & ~self.waiting_for_key
+        running = np.flatnonzero(executing)
+        if len(running) == 0:
+            return executing
+        program_counter = self.program_counter[running]
+
+        # Python lists allow negative indexes,  so step() does too
+        outside = (program_counter < -MEMORY_SIZE) | (program_counter > MEMORY_SIZE - 2)
+        if outside.any():
+            self.halt(running[outside], "IndexError('list index out of range')")
+            running = running[~outside]
+            program_counter = program_counter[~outside]
+            if len(running) == 0:
+                return executing & ~self.halted
+
+        ops = (self.memory[running, program_counter].astype(np.int64) << 8) | self.memory[running, program_counter + 1]
+        ops = ops & 0xFFFF
+        handlers = HANDLER_INDEX[ops]
+
+        # Sort by handler so each group is a contiguous slice
+        order = np.argsort(handlers, kind="stable")
+        running = running[order]
+        ops = ops[order]
+        handlers = handlers[order]
+        boundaries = np.flatnonzero(np.diff(handlers)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(handlers)]))
+        for start, end in zip(starts, ends):
+            BATCH_HANDLERS[handlers[start]](self, running[start:end], ops[start:end])
+        # Not a machine halted by this instruction,  step() would have raised rather than executing it
+        return executing & ~self.halted
+
+    def run(self, instructions: int):
+        for _ in range(instructions):
+            executed = self.step()
+            self.cycles += executed
+            self.idle_cycles += self.waiting_for_key & ~executed
+
+    def tick_timers(self):
+        self.delay_timer = np.where(self.delay_timer > 0, self.delay_timer - 1, self.delay_timer)
+        self.sound_timer = np.where(self.sound_timer > 0, self.sound_timer - 1, self.sound_timer)
+
+    def run_frame(self, hz: int = DEFAULT_HZ):
+        """
+            As scheduler.run_frame() at a fixed speed,  for every machine at once.
+        """
+        self.run(instructions_per_frame(hz))
+        self.tick_timers()
+
+    def frames(self) -> np.ndarray:
+        """
+            The displays as a (count, 32, 64) array of 0s and 1s.
+        """
+        rows = self.display.astype(">u8").view(np.uint8).reshape(self.count, 32, 8)
+        return np.unpackbits(rows, axis=2)
+
+    def machine(self, index: int) -> Machine:
+        """
+            Copies one row out into an ordinary Machine.
+        """
+        machine = Machine()
+        machine.memory[:] = self.memory[index].tobytes()
+        machine.registers[:] = self.registers[index].astype(np.uint8).tobytes()
+        machine.stack[:] = array("H", self.stack[index].tolist())
+        machine.stack_pointer = int(self.stack_pointer[index])
+        machine.program_counter = int(self.program_counter[index])
+        machine.I = int(self.I[index])
+        machine.display = [int(row) for row in self.display[index]]
+        machine.display_dirty = bool(self.display_dirty[index])
+        machine.delay_timer = int(self.delay_timer[index])
+        machine.sound_timer = int(self.sound_timer[index])
+        machine.keys = sum(1 << int(key) for key in np.flatnonzero(self.keys[index]))
+        machine.waiting_for_key = bool(self.waiting_for_key[index])
+        machine.cycles = int(self.cycles[index])
+        machine.idle_cycles = int(self.idle_cycles[index])
+        return machine
+
+    def load_machine(self, index: int, machine: Machine):
+        """
+            Copies an ordinary Machine into one row,  the reverse of machine().
+        """
+        self.memory[index] = np.frombuffer(bytes(machine.memory), dtype=np.uint8)
+        self.registers[index] = np.frombuffer(bytes(machine.registers), dtype=np.uint8)
+        self.stack[index] = machine.stack
+        self.stack_pointer[index] = machine.stack_pointer
+        self.program_counter[index] = machine.program_counter
+        self.I[index] = machine.I
+        self.display[index] = np.array(machine.display, dtype=np.uint64)
+        self.display_dirty[index] = machine.display_dirty
+        self.delay_timer[index] = machine.delay_timer
+        self.sound_timer[index] = machine.sound_timer
+        self.keys[index] = [(machine.keys >> key) & 1 for key in range(0x10)]
+        self.waiting_for_key[index] = machine.waiting_for_key
+        self.cycles[index] = machine.cycles
+        self.idle_cycles[index] = machine.idle_cycles
+
+
+def _x(ops: np.ndarray) -> np.ndarray:
+    return (ops >> 8) & 0xF
+
+
+def _y(ops: np.ndarray) -> np.ndarray:
+    return (ops >> 4) & 0xF
+
+
+def _advance(batch: BatchMachine, machines: np.ndarray):
+    batch.program_counter[machines] += 2
+
+
+def _skip_if(batch: BatchMachine, machines: np.ndarray, condition: np.ndarray):
+    batch.program_counter[machines] += np.where(condition, 4, 2)
+
+
+def _memory_in_range(batch: BatchMachine, machines: np.ndarray, first: np.ndarray, last: np.ndarray):
+    """
+        Halts the machines which would read or write outside memory,  returns a mask of those which won't.
+    """
+    ok = (first >= -MEMORY_SIZE) & (last < MEMORY_SIZE)
+    if not ok.all():
+        batch.halt(machines[~ok], "IndexError('list index out of range')")
+    return ok
+
+
+def batch_clear_screen(batch, machines, ops):
+    batch.display[machines] = 0
+    batch.display_dirty[machines] = True
+    _advance(batch, machines)
+
+
+def batch_return(batch, machines, ops):
+    empty = batch.stack_pointer[machines] == 0
+    if empty.any():
+        batch.halt(machines[empty], "ValueError('Stack underflow')")
+        machines = machines[~empty]
+    batch.stack_pointer[machines] -= 1
+    batch.program_counter[machines] = batch.stack[machines, batch.stack_pointer[machines]]
+
+
+def batch_jump(batch, machines, ops):
+    batch.program_counter[machines] = ops & 0xFFF
+
+
+def batch_call(batch, machines, ops):
+    full = batch.stack_pointer[machines] == STACK_SIZE
+    if full.any():
+        batch.halt(machines[full], "ValueError('Stack overflow')")
+        machines = machines[~full]
+        ops = ops[~full]
+    batch.stack[machines, batch.stack_pointer[machines]] = batch.program_counter[machines] + 2
+    batch.stack_pointer[machines] += 1
+    batch.program_counter[machines] = ops & 0xFFF
+
+
+def batch_skip_if_equal(batch, machines, ops):
+    _skip_if(batch, machines, batch.registers[machines, _x(ops)] == (ops & 0xFF))
+
+
+def batch_skip_if_not_equal(batch, machines, ops):
+    _skip_if(batch, machines, batch.registers[machines, _x(ops)] != (ops & 0xFF))
+
+
+def batch_skip_if_registers_equal(batch, machines, ops):
+    _skip_if(batch, machines, batch.registers[machines, _x(ops)] == batch.registers[machines, _y(ops)])
+
+
+def batch_skip_if_registers_not_equal(batch, machines, ops):
+    _skip_if(batch, machines, batch.registers[machines, _x(ops)] != batch.registers[machines, _y(ops)])
+
+
+def batch_set(batch, machines, ops):
+    batch.registers[machines, _x(ops)] = ops & 0xFF
+    _advance(batch, machines)
+
+
+def batch_add(batch, machines, ops):
+    X = _x(ops)
+    batch.registers[machines, X] = (batch.registers[machines, X] + (ops & 0xFF)) % 0x100
+    _advance(batch, machines)
+
+
+def batch_assign(batch, machines, ops):
+    batch.registers[machines, _x(ops)] = batch.registers[machines, _y(ops)]
+    _advance(batch, machines)
+
+
+def batch_or(batch, machines, ops):
+    X = _x(ops)
+    batch.registers[machines, X] = batch.registers[machines, X] | batch.registers[machines, _y(ops)]
+    _advance(batch, machines)
+
+
+def batch_and(batch, machines, ops):
+    X = _x(ops)
+    batch.registers[machines, X] = batch.registers[machines, X] & batch.registers[machines, _y(ops)]
+    _advance(batch, machines)
+
+
+def batch_xor(batch, machines, ops):
+    X = _x(ops)
+    batch.registers[machines, X] = batch.registers[machines, X] ^ batch.registers[machines, _y(ops)]
+    _advance(batch, machines)
+
+
+# The arithmetic handlers below follow step() statement by statement,  writing Vx before VF,
+# so that they give the same answer when X is 0xF.
+
+def batch_add_registers(batch, machines, ops):
+    registers = batch.registers
+    X = _x(ops)
+    total = registers[machines, X] + registers[machines, _y(ops)]
+    registers[machines, X] = total & 0xFF
+    registers[machines, 0xF] = total > 0xFF
+    _advance(batch, machines)
+
+
+def batch_subtract(batch, machines, ops):
+    registers = batch.registers
+    X = _x(ops)
+    difference = registers[machines, X] - registers[machines, _y(ops)]
+    registers[machines, X] = difference & 0xFF
+    registers[machines, 0xF] = difference < 0x0
+    _advance(batch, machines)
+
+
+def batch_shift_right(batch, machines, ops):
+    registers = batch.registers
+    X = _x(ops)
+    registers[machines, 0xF] = registers[machines, X] & 0b00000001
+    registers[machines, X] = registers[machines, X] >> 1
+    _advance(batch, machines)
+
+
+def batch_subtract_reversed(batch, machines, ops):
+    registers = batch.registers
+    X = _x(ops)
+    difference = registers[machines, _y(ops)] - registers[machines, X]
+    registers[machines, X] = difference & 0xFF
+    registers[machines, 0xF] = np.where(difference < 0, 0, 1)
+    _advance(batch, machines)
+
+
+def batch_shift_left(batch, machines, ops):
+    registers = batch.registers
+    X = _x(ops)
+    registers[machines, 0xF] = registers[machines, X] & 0b10000000
+    registers[machines, X] = (registers[machines, X] << 1) & 0b11111111
+    _advance(batch, machines)
+
+
+def batch_set_index(batch, machines, ops):
+    batch.I[machines] = ops & 0xFFF
+    _advance(batch, machines)
+
+
+def batch_jump_offset(batch, machines, ops):
+    batch.program_counter[machines] = (ops & 0xFFF) + batch.registers[machines, 0x0]
+
+
+def batch_random(batch, machines, ops):
+    values = np.array([batch.random[i].randint(0, 255) for i in machines], dtype=np.int64)
+    batch.registers[machines, _x(ops)] = values & ops & 0xFF
+    _advance(batch, machines)
+
+
+def batch_draw(batch, machines, ops):
+    registers = batch.registers
+    vX = registers[machines, _x(ops)].astype(np.int64)
+    vY = registers[machines, _y(ops)].astype(np.int64)
+    N = ops & 0xF
+    I = batch.I[machines]
+    # step() draws the rows before one past the end of memory,  then raises
+    rows = np.clip(MEMORY_SIZE - I, 0, N)
+
+    shift = (vX % 64).astype(np.uint64)
+    registers[machines, 0xF] = 0
+    for row in range(int(rows.max(initial=0))):
+        drawing = row < rows
+        rows_machines = machines[drawing]
+        bits = (batch.memory[rows_machines, I[drawing] + row].astype(np.uint64) & np.uint64(0xFF)) << np.uint64(56)
+        row_shift = shift[drawing]
+        # A shift by 64 isn't defined for uint64,  so an unshifted sprite is handled separately
+        rotated = (bits >> row_shift) | (bits << ((np.uint64(64) - row_shift) % np.uint64(64)))
+        bits = np.where(row_shift == 0, bits, rotated)
+        line = (row + vY[drawing]) % 32
+        collided = (batch.display[rows_machines, line] & bits) != 0
+        registers[rows_machines[collided], 0xF] = 1
+        batch.display[rows_machines, line] ^= bits
+
+    short = rows < N
+    if short.any():
+        batch.halt(machines[short], "IndexError('list index out of range')")
+        machines = machines[~short]
+    batch.display_dirty[machines] = True
+    _advance(batch, machines)
+
+
+def _key_pressed(batch: BatchMachine, machines: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    # Keys outside 0-F are never pressed
+    valid = (keys >= 0) & (keys < 0x10)
+    return valid & batch.keys[machines, np.where(valid, keys, 0)]
+
+
+def batch_skip_if_key(batch, machines, ops):
+    _skip_if(batch, machines, _key_pressed(batch, machines, batch.registers[machines, _x(ops)]))
+
+
+def batch_skip_if_not_key(batch, machines, ops):
+    _skip_if(batch, machines, ~_key_pressed(batch, machines, batch.registers[machines, _x(ops)]))
+
+
+def batch_get_delay_timer(batch, machines, ops):
+    batch.registers[machines, _x(ops)] = batch.delay_timer[machines]
+    _advance(batch, machines)
+
+
+def batch_wait_for_key(batch, machines, ops):
+    keys = batch.keys[machines]
+    pressed = keys.any(axis=1)
+    batch.waiting_for_key[machines[~pressed]] = True
+    machines = machines[pressed]
+    batch.registers[machines, _x(ops[pressed])] = keys[pressed].argmax(axis=1)
+    _advance(batch, machines)
+
+
+def batch_set_delay_timer(batch, machines, ops):
+    batch.delay_timer[machines] = batch.registers[machines, _x(ops)]
+    _advance(batch, machines)
+
+
+def batch_set_sound_timer(batch, machines, ops):
+    batch.sound_timer[machines] = batch.registers[machines, _x(ops)]
+    _advance(batch, machines)
+
+
+def batch_add_index(batch, machines, ops):
+    batch.I[machines] = (batch.I[machines] + batch.registers[machines, _x(ops)]) % 0x10000
+    _advance(batch, machines)
+
+
+def batch_font(batch, machines, ops):
+    batch.I[machines] = batch.registers[machines, _x(ops)] * 5
+    _advance(batch, machines)
+
+
+def batch_bcd(batch, machines, ops):
+    I = batch.I[machines]
+    ok = _memory_in_range(batch, machines, I, I + 2)
+    machines, ops, I = machines[ok], ops[ok], I[ok]
+    vx = batch.registers[machines, _x(ops)]
+    batch.memory[machines, I] = vx // 100
+    batch.memory[machines, I + 1] = (vx % 100) // 10
+    batch.memory[machines, I + 2] = vx % 10
+    _advance(batch, machines)
+
+
+def batch_store(batch, machines, ops):
+    X = _x(ops)
+    I = batch.I[machines]
+    ok = _memory_in_range(batch, machines, I, I + X)
+    machines, X, I = machines[ok], X[ok], I[ok]
+    for i in range(0x10):
+        storing = i <= X
+        batch.memory[machines[storing], I[storing] + i] = batch.registers[machines[storing], i]
+    _advance(batch, machines)
+
+
+def batch_load(batch, machines, ops):
+    X = _x(ops)
+    I = batch.I[machines]
+    # step() loads the registers before one past the end of memory,  then raises
+    count = np.clip(MEMORY_SIZE - I, 0, X + 1)
+    for i in range(0x10):
+        loading = i < count
+        batch.registers[machines[loading], i] = batch.memory[machines[loading], I[loading] + i]
+    short = count < X + 1
+    if short.any():
+        batch.halt(machines[short], "IndexError('list index out of range')")
+        machines = machines[~short]
+    _advance(batch, machines)
+
+
+def batch_unknown(batch, machines, ops):
+    for i, op in zip(machines, ops):
+        batch.halt([i], f"ValueError('Unknown opcode {hex(op >> 8)}-{hex(op & 0xFF)}')")
+
+
+HANDLERS = {
+    op_clear_screen: batch_clear_screen,
+    op_return: batch_return,
+    op_jump: batch_jump,
+    op_call: batch_call,
+    op_skip_if_equal: batch_skip_if_equal,
+    op_skip_if_not_equal: batch_skip_if_not_equal,
+    op_skip_if_registers_equal: batch_skip_if_registers_equal,
+    op_set: batch_set,
+    op_add: batch_add,
+    op_assign: batch_assign,
+    op_or: batch_or,
+    op_and: batch_and,
+    op_xor: batch_xor,
+    op_add_registers: batch_add_registers,
+    op_subtract: batch_subtract,
+    op_shift_right: batch_shift_right,
+    op_subtract_reversed: batch_subtract_reversed,
+    op_shift_left: batch_shift_left,
+    op_skip_if_registers_not_equal: batch_skip_if_registers_not_equal,
+    op_set_index: batch_set_index,
+    op_jump_offset: batch_jump_offset,
+    op_random: batch_random,
+    op_draw: batch_draw,
+    op_skip_if_key: batch_skip_if_key,
+    op_skip_if_not_key: batch_skip_if_not_key,
+    op_get_delay_timer: batch_get_delay_timer,
+    op_wait_for_key: batch_wait_for_key,
+    op_set_delay_timer: batch_set_delay_timer,
+    op_set_sound_timer: batch_set_sound_timer,
+    op_add_index: batch_add_index,
+    op_font: batch_font,
+    op_bcd: batch_bcd,
+    op_store: batch_store,
+    op_load: batch_load,
+    op_unknown: batch_unknown,
+}
+
+# The DISPATCH_TABLE turned into small integers,  so a whole batch can be decoded at once
+BATCH_HANDLERS = list(HANDLERS.values())
+_POSITIONS = {handler: position for position, handler in enumerate(HANDLERS)}
+HANDLER_INDEX = np.array([_POSITIONS[handler] for handler in DISPATCH_TABLE], dtype=np.uint8)
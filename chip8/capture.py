@@ -0,0 +1,341 @@
+"""
+    Frame capture.
+
+    CaptureDisplay is a display backend which appends every frame it is shown to a capture
+    file (passing it on to another display too,  if given one),  so gameplay can be recorded
+    for diffing against later runs or for datasets.  Recording is only packing a few bytes and
+    a buffered write,  the exporters below turn a capture into images afterwards.
+
+    A capture file is a header followed by one record per presented frame:
+
+        header      "C8CV",  version,  keyframe interval          8 bytes
+        record      frame number,  flags,  changed rows mask       9 bytes
+                    each changed row,  top first                   8 bytes each (big endian)
+
+    Every keyframe_interval'th record is a keyframe holding all 32 rows,  the rest hold only
+    the rows which changed since the record before.  close() appends an index of where each
+    record starts and a footer pointing at it:
+
+        index       offset of each record                          8 bytes each
+        footer      index offset,  records,  "C8IX"                16 bytes
+
+    so CaptureReader can jump straight to any frame by reading the keyframe before it and the
+    records since.  A file which was never closed has no index,  the reader then finds the
+    records by reading through it once.
+
+        python -m chip8.capture record c8games/INVADERS invaders.c8v --frames 600 --keys 5
+        python -m chip8.capture export invaders.c8v --gif invaders.gif --png frames
+"""
+import argparse
+import os
+import struct
+import zlib
+from array import array
+from typing import Iterator, List, Tuple
+
+from .backends import Display, ScriptedKeypad
+from .emulator import Emulator
+from .machine import Machine
+
+CAPTURE_MAGIC = b"C8CV"
+CAPTURE_VERSION = 1
+INDEX_MAGIC = b"C8IX"
+
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<IBI")
+FOOTER = struct.Struct("<QI4s")
+ROW = struct.Struct(">Q")
+KEYFRAME = 1
+ALL_ROWS = 0xFFFFFFFF
+
+
+class CaptureDisplay(Display):
+    """
+        Records each presented frame to filename.  Call set_frame() before running each frame
+        so records carry the frame number,  otherwise they are numbered as they arrive.
+    """
+
+    def __init__(self, filename: str, display: Display = None, keyframe_interval: int = 60):
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, keyframe_interval))
+        self.display = display
+        self.keyframe_interval = keyframe_interval
+        self.offsets = array("Q")
+        self.last_display = [0] * 32
+        self.frame = None
+
+    def set_frame(self, frame: int):
+        self.frame = frame
+
+    def present(self, machine: Machine):
+        display = machine.display
+        last_display = self.last_display
+        index = len(self.offsets)
+        frame = self.frame if self.frame is not None else index
+        self.offsets.append(self.file.tell())
+
+        if index % self.keyframe_interval == 0:
+            self.file.write(RECORD.pack(frame, KEYFRAME, ALL_ROWS) + struct.pack(">32Q", *display))
+        else:
+            mask = 0
+            rows = []
+            for row in range(32):
+                if display[row] != last_display[row]:
+                    mask = mask | (1 << row)
+                    rows.append(display[row])
+            self.file.write(RECORD.pack(frame, 0, mask) + struct.pack(f">{len(rows)}Q", *rows))
+        self.last_display = display[:]
+
+        if self.display is not None:
+            self.display.present(machine)
+
+    def close(self):
+        index_offset = self.file.tell()
+        self.file.write(self.offsets.tobytes())
+        self.file.write(FOOTER.pack(index_offset, len(self.offsets), INDEX_MAGIC))
+        self.file.close()
+
+
+class CaptureReader:
+    """
+        Random access to the frames of a capture file.  reader[i] is the display (32 rows) of
+        the i'th record,  reader.frames[i] its frame number.
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as f:
+            self.data = f.read()
+        magic, version, self.keyframe_interval = HEADER.unpack_from(self.data)
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("Not a capture file")
+        if version != CAPTURE_VERSION:
+            raise ValueError(f"Capture version {version} is not supported,  expected {CAPTURE_VERSION}")
+        self.offsets = self._read_index()
+        self.frames = [RECORD.unpack_from(self.data, offset)[0] for offset in self.offsets]
+
+    def _read_index(self) -> List[int]:
+        data = self.data
+        if len(data) >= HEADER.size + FOOTER.size:
+            index_offset, records, magic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+            if magic == INDEX_MAGIC and index_offset + 8 * records + FOOTER.size == len(data):
+                offsets = array("Q")
+                offsets.frombytes(data[index_offset:index_offset + 8 * records])
+                return list(offsets)
+
+        # Never closed,  so find the records by walking them
+        offsets = []
+        offset = HEADER.size
+        while offset + RECORD.size <= len(data):
+            _, _, mask = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + ROW.size * bin(mask).count("1")
+            if end > len(data):
+                break
+            offsets.append(offset)
+            offset = end
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _apply(self, display: List[int], index: int):
+        data = self.data
+        offset = self.offsets[index]
+        _, _, mask = RECORD.unpack_from(data, offset)
+        offset = offset + RECORD.size
+        while mask:
+            row = (mask & -mask).bit_length() - 1
+            display[row] = ROW.unpack_from(data, offset)[0]
+            offset = offset + ROW.size
+            mask = mask & (mask - 1)
+
+    def __getitem__(self, index: int) -> List[int]:
+        if not 0 <= index < len(self.offsets):
+            raise IndexError(f"Capture has {len(self.offsets)} frames")
+        display = [0] * 32
+        for record in range(index - index % self.keyframe_interval, index + 1):
+            self._apply(display, record)
+        return display
+
+    def __iter__(self) -> Iterator[Tuple[int, List[int]]]:
+        """
+            Every (frame number,  display) in order,  applying each record once.
+        """
+        display = [0] * 32
+        for index in range(len(self.offsets)):
+            self._apply(display, index)
+            yield self.frames[index], display[:]
+
+
+def _scaled_rows(display: List[int], scale: int) -> Iterator[str]:
+    # Each row of pixels as a string of "0" and "1",  scale times wider and repeated scale times
+    for row in display:
+        pixels = "".join(bit * scale for bit in format(row, "064b"))
+        for _ in range(scale):
+            yield pixels
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_image(display: List[int], scale: int = 1) -> bytes:
+    """
+        The display as a black and white PNG,  one bit per pixel.
+    """
+    width, height = 64 * scale, 32 * scale
+    scanlines = b"".join(b"\x00" + int(pixels, 2).to_bytes(width // 8, "big")
+                         for pixels in _scaled_rows(display, scale))
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(scanlines))
+            + _png_chunk(b"IEND", b""))
+
+
+def _lzw(pixels: bytes, minimum_code_size: int = 2) -> bytes:
+    """
+        GIF flavoured LZW:  variable width codes from minimum_code_size + 1 bits up to 12,
+        packed least significant bit first.  The table maps (code of a string,  next pixel)
+        to the code of the longer string.
+    """
+    clear = 1 << minimum_code_size
+    output = bytearray()
+    buffer = clear
+    bits = width = minimum_code_size + 1
+    table = {}
+    next_code = clear + 2
+
+    current = pixels[0]
+    for pixel in pixels[1:]:
+        extended = table.get((current, pixel))
+        if extended is not None:
+            current = extended
+            continue
+        buffer = buffer | (current << bits)
+        bits = bits + width
+        if next_code < 4096:
+            table[(current, pixel)] = next_code
+            next_code = next_code + 1
+            if next_code > (1 << width) and width < 12:
+                width = width + 1
+        else:
+            buffer = buffer | (clear << bits)
+            bits = bits + width
+            table = {}
+            next_code = clear + 2
+            width = minimum_code_size + 1
+        current = pixel
+        while bits >= 8:
+            output.append(buffer & 0xFF)
+            buffer = buffer >> 8
+            bits = bits - 8
+
+    buffer = buffer | (current << bits)
+    bits = bits + width
+    # The decoder adds a string for the last code too,  which can widen the end code
+    if next_code == (1 << width) and width < 12:
+        width = width + 1
+    buffer = buffer | ((clear + 1) << bits)
+    bits = bits + width
+    while bits > 0:
+        output.append(buffer & 0xFF)
+        buffer = buffer >> 8
+        bits = bits - 8
+    return bytes(output)
+
+
+def gif_animation(frames: Iterator[Tuple[int, List[int]]], scale: int = 1, frame_rate: int = 60) -> bytes:
+    """
+        An endlessly looping GIF of (frame number,  display) pairs.  Each image stays up until
+        the frame number of the next one.  After the first,  each image only covers the rows
+        from the first to the last which changed,  drawn over the one before.
+    """
+    frames = list(frames)
+    width, height = 64 * scale, 32 * scale
+    output = bytearray(b"GIF89a")
+    # Logical screen with a two colour global colour table of black and white
+    output += struct.pack("<HHBBB", width, height, 0x80, 0, 0) + b"\x00\x00\x00\xff\xff\xff"
+    output += b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00"
+    to_pixels = bytes.maketrans(b"01", b"\x00\x01")
+
+    shown = 0       # Hundredths of a second,  GIF's unit for delays
+    previous = None
+    for position, (frame, display) in enumerate(frames):
+        next_frame = frames[position + 1][0] if position + 1 < len(frames) else frame + 1
+        until = (next_frame - frames[0][0]) * 100 / frame_rate
+        delay = max(round(until - shown), 1)
+        shown = shown + delay
+
+        changed = [row for row in range(32) if previous is None or display[row] != previous[row]]
+        first, last = (changed[0], changed[-1]) if changed else (0, 0)
+        previous = display
+
+        # Leave each image in place for the next to draw over
+        output += b"\x21\xf9\x04\x04" + struct.pack("<H", delay) + b"\x00\x00"
+        output += b"\x2c" + struct.pack("<HHHHB", 0, first * scale, width, (last - first + 1) * scale, 0)
+        pixels = "".join(_scaled_rows(display[first:last + 1], scale)).encode().translate(to_pixels)
+        data = _lzw(pixels)
+        output.append(2)
+        for start in range(0, len(data), 255):
+            block = data[start:start + 255]
+            output.append(len(block))
+            output += block
+        output.append(0)
+    output.append(0x3B)
+    return bytes(output)
+
+
+def export_png(reader: CaptureReader, directory: str, scale: int = 4) -> int:
+    """
+        Writes each captured frame to directory as frame_NNNNNN.png,  named by frame number.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for frame, display in reader:
+        with open(os.path.join(directory, f"frame_{frame:06d}.png"), "wb") as f:
+            f.write(png_image(display, scale))
+    return len(reader)
+
+
+def export_gif(reader: CaptureReader, filename: str, scale: int = 4):
+    with open(filename, "wb") as f:
+        f.write(gif_animation(iter(reader), scale))
+
+
+def record(rom: str, filename: str, frames: int, keys: List[int], engine: str = "table"):
+    keypad = ScriptedKeypad([(0, keys)])
+    keypad.set_frame(0)
+    capture = CaptureDisplay(filename)
+    emulator = Emulator(display=capture, keypad=keypad, engine=engine)
+    emulator.load_rom(rom)
+    try:
+        for frame in range(frames):
+            capture.set_frame(frame)
+            emulator.run_frame()
+    finally:
+        capture.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and export frame captures")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="run a rom headless and capture its frames")
+    record_parser.add_argument("rom")
+    record_parser.add_argument("capture")
+    record_parser.add_argument("--frames", type=int, default=600)
+    record_parser.add_argument("--keys", default="", help="hex digits of the keys to hold down,  e.g. 5")
+    export_parser = commands.add_parser("export", help="turn a capture into PNGs and/or a GIF")
+    export_parser.add_argument("capture")
+    export_parser.add_argument("--png", metavar="DIRECTORY")
+    export_parser.add_argument("--gif", metavar="FILE")
+    export_parser.add_argument("--scale", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.rom, args.capture, args.frames, [int(key, 16) for key in args.keys])
+        print(f"{len(CaptureReader(args.capture))} frames captured,  {os.path.getsize(args.capture):,} bytes")
+    else:
+        reader = CaptureReader(args.capture)
+        if args.png:
+            print(f"{export_png(reader, args.png, args.scale)} frames written to {args.png}")
+        if args.gif:
+            export_gif(reader, args.gif, args.scale)
+            print(f"{len(reader)} frames written to {args.gif}")
@@ -0,0 +1,117 @@
+"""
+    Network client.
+
+    A stand-in client for chip8.server:  joins a session,  holds down keys and rebuilds the
+    display from the frames it is sent.  Useful for trying the server out over loopback.
+
+        python -m chip8.client --rom INVADERS --keys 5 --frames 600 --show
+        python -m chip8.client --serve --rom PONG       runs its own server in the same process
+"""
+import argparse
+import asyncio
+import json
+
+from .library import RomLibrary
+from .server import ERROR, FRAME, JOIN, KEYS, Server, apply_frame, encode_message, read_message
+
+
+class SessionStopped(Exception):
+    pass
+
+
+class Client:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.display = [0] * 32
+        self.frame = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8064) -> "Client":
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def join(self, session: str, rom: str):
+        self.writer.write(encode_message(JOIN, json.dumps({"session": session, "rom": rom}).encode()))
+        await self.writer.drain()
+
+    async def send_keys(self, keys: int):
+        self.writer.write(encode_message(KEYS, keys.to_bytes(2, "little")))
+        await self.writer.drain()
+
+    async def receive_frame(self) -> int:
+        """
+            Waits for the next frame,  applies it to display and returns its frame number.
+            Raises SessionStopped if the server sends an error.
+        """
+        kind, payload = await read_message(self.reader)
+        if kind == ERROR:
+            raise SessionStopped(payload.decode())
+        if kind != FRAME:
+            raise ValueError(f"Unexpected message {kind}")
+        self.frame = apply_frame(self.display, payload)
+        self.frames_received = self.frames_received + 1
+        self.bytes_received = self.bytes_received + len(payload)
+        return self.frame
+
+    def close(self):
+        self.writer.close()
+
+    def show(self):
+        print('=' * 64)
+        for row in self.display:
+            print(format(row, "064b").replace("0", " ").replace("1", "*"))
+        print('=' * 64)
+
+
+async def main(args):
+    server = listening = None
+    port = args.port
+    if args.serve:
+        server = Server(RomLibrary(args.roms))
+        listening = await server.start(args.host, 0)
+        port = listening.sockets[0].getsockname()[1]
+
+    client = await Client.connect(args.host, port)
+    await client.join(args.session, args.rom)
+    keys = 0
+    for key in args.keys:
+        keys = keys | (1 << int(key, 16))
+    await client.send_keys(keys)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first_frame = None
+    try:
+        while client.frame - (first_frame or 0) < args.frames:
+            frame = await client.receive_frame()
+            if first_frame is None:
+                first_frame = frame
+    except SessionStopped as e:
+        print(e)
+    elapsed = loop.time() - started
+    client.close()
+    if server is not None:
+        await server.stop(listening)
+
+    if args.show:
+        client.show()
+    frames = client.frame - (first_frame or 0)
+    print(f"{client.frames_received:,} updates over {frames:,} frames in {elapsed:.1f}s,"
+          f"  {client.bytes_received:,} bytes ({client.bytes_received / max(client.frames_received, 1):.1f} per update)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch and play a session on a chip8.server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8064)
+    parser.add_argument("--session", default="default")
+    parser.add_argument("--rom", default="INVADERS")
+    parser.add_argument("--keys", default="", help="hex digits of the keys to hold down,  e.g. 5")
+    parser.add_argument("--frames", type=int, default=300, help="frames to watch before leaving")
+    parser.add_argument("--show", action="store_true", help="print the display when done")
+    parser.add_argument("--serve", action="store_true", help="run a server in this process on a free port")
+    parser.add_argument("--roms", default="c8games", help="roms for --serve")
+    asyncio.run(main(parser.parse_args()))
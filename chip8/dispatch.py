@@ -0,0 +1,381 @@
+"""
+    Table driven dispatch.
+
+    Rather than walking the if/elif chain in step() for every instruction, each of the
+    65536 possible 16 bit opcodes is decoded once up front into a handler.  Running an
+    instruction is then a single table lookup followed by a single call.
+
+    The handlers below must leave the machine in exactly the same state as step().
+"""
+import random
+
+from .machine import Machine, byte, draw_sprite, font_address
+
+
+def op_clear_screen(machine: Machine, op: int):
+    # 00E0
+    machine.display = [0] * 32
+    machine.display_dirty = True
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_return(machine: Machine, op: int):
+    # 00EE
+    machine.program_counter = machine.pop()
+
+
+def op_jump(machine: Machine, op: int):
+    # 1NNN
+    machine.program_counter = op & 0xFFF
+
+
+def op_call(machine: Machine, op: int):
+    # 2NNN
+    machine.push(machine.program_counter + 2)
+    machine.program_counter = op & 0xFFF
+
+
+def op_skip_if_equal(machine: Machine, op: int):
+    # 3XNN
+    if machine.registers[(op >> 8) & 0xF] == op & 0xFF:
+        machine.program_counter = machine.program_counter + 4
+    else:
+        machine.program_counter = machine.program_counter + 2
+
+
+def op_skip_if_not_equal(machine: Machine, op: int):
+    # 4XNN
+    if machine.registers[(op >> 8) & 0xF] != op & 0xFF:
+        machine.program_counter = machine.program_counter + 4
+    else:
+        machine.program_counter = machine.program_counter + 2
+
+
+def op_skip_if_registers_equal(machine: Machine, op: int):
+    # 5XY0
+    registers = machine.registers
+    if registers[(op >> 8) & 0xF] == registers[(op >> 4) & 0xF]:
+        machine.program_counter = machine.program_counter + 4
+    else:
+        machine.program_counter = machine.program_counter + 2
+
+
+def op_set(machine: Machine, op: int):
+    # 6XNN
+    machine.registers[(op >> 8) & 0xF] = op & 0xFF
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_add(machine: Machine, op: int):
+    # 7XNN
+    X = (op >> 8) & 0xF
+    machine.registers[X] = (machine.registers[X] + (op & 0xFF)) % 0x100
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_assign(machine: Machine, op: int):
+    # 8XY0
+    machine.registers[(op >> 8) & 0xF] = machine.registers[(op >> 4) & 0xF]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_or(machine: Machine, op: int):
+    # 8XY1
+    X = (op >> 8) & 0xF
+    machine.registers[X] = machine.registers[X] | machine.registers[(op >> 4) & 0xF]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_and(machine: Machine, op: int):
+    # 8XY2
+    X = (op >> 8) & 0xF
+    machine.registers[X] = machine.registers[X] & machine.registers[(op >> 4) & 0xF]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_xor(machine: Machine, op: int):
+    # 8XY3
+    X = (op >> 8) & 0xF
+    machine.registers[X] = machine.registers[X] ^ machine.registers[(op >> 4) & 0xF]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_add_registers(machine: Machine, op: int):
+    # 8XY4
+    registers = machine.registers
+    X = (op >> 8) & 0xF
+    total = registers[X] + registers[(op >> 4) & 0xF]
+    registers[X] = total & 0xFF
+    registers[0xF] = 1 if total > 0xFF else 0
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_subtract(machine: Machine, op: int):
+    # 8XY5
+    registers = machine.registers
+    X = (op >> 8) & 0xF
+    difference = registers[X] - registers[(op >> 4) & 0xF]
+    registers[X] = difference & 0xFF
+    registers[0xF] = 1 if difference < 0x0 else 0
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_shift_right(machine: Machine, op: int):
+    # 8XY6
+    registers = machine.registers
+    X = (op >> 8) & 0xF
+    registers[0xF] = registers[X] & 0b00000001
+    registers[X] = registers[X] >> 1
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_subtract_reversed(machine: Machine, op: int):
+    # 8XY7
+    registers = machine.registers
+    X = (op >> 8) & 0xF
+    difference = registers[(op >> 4) & 0xF] - registers[X]
+    registers[X] = difference & 0xFF
+    if difference < 0:
+        registers[0xF] = 0
+    else:
+        registers[0xF] = 1
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_shift_left(machine: Machine, op: int):
+    # 8XY8 - step() decodes Vx<<=1 from n3 == 0x8 rather than 0xE,  so we do too
+    registers = machine.registers
+    X = (op >> 8) & 0xF
+    registers[0xF] = registers[X] & 0b10000000
+    registers[X] = (registers[X] << 1) & 0b11111111
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_skip_if_registers_not_equal(machine: Machine, op: int):
+    # 9XY0
+    registers = machine.registers
+    if registers[(op >> 8) & 0xF] != registers[(op >> 4) & 0xF]:
+        machine.program_counter = machine.program_counter + 4
+    else:
+        machine.program_counter = machine.program_counter + 2
+
+
+def op_set_index(machine: Machine, op: int):
+    # ANNN
+    machine.I = op & 0xFFF
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_jump_offset(machine: Machine, op: int):
+    # BNNN
+    machine.program_counter = (op & 0xFFF) + machine.registers[0x0]
+
+
+def op_random(machine: Machine, op: int):
+    # CXNN
+    machine.registers[(op >> 8) & 0xF] = random.randint(0, 255) & op & 0xFF
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_draw(machine: Machine, op: int):
+    # DXYN
+    registers = machine.registers
+    draw_sprite(machine, registers[(op >> 8) & 0xF], registers[(op >> 4) & 0xF], op & 0xF)
+    machine.display_dirty = True
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_skip_if_key(machine: Machine, op: int):
+    # EX9E
+    if (machine.keys >> machine.registers[(op >> 8) & 0xF]) & 1:
+        machine.program_counter = machine.program_counter + 4
+    else:
+        machine.program_counter = machine.program_counter + 2
+
+
+def op_skip_if_not_key(machine: Machine, op: int):
+    # EXA1
+    if not (machine.keys >> machine.registers[(op >> 8) & 0xF]) & 1:
+        machine.program_counter = machine.program_counter + 4
+    else:
+        machine.program_counter = machine.program_counter + 2
+
+
+def op_get_delay_timer(machine: Machine, op: int):
+    # FX07
+    machine.registers[(op >> 8) & 0xF] = machine.delay_timer
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_wait_for_key(machine: Machine, op: int):
+    # FX0A - parks the CPU while no key is down,  see step()
+    keys = machine.keys
+    if keys:
+        machine.registers[(op >> 8) & 0xF] = (keys & -keys).bit_length() - 1
+        machine.program_counter = machine.program_counter + 2
+    else:
+        machine.waiting_for_key = True
+
+
+def op_set_delay_timer(machine: Machine, op: int):
+    # FX15
+    machine.delay_timer = machine.registers[(op >> 8) & 0xF]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_set_sound_timer(machine: Machine, op: int):
+    # FX18
+    machine.sound_timer = machine.registers[(op >> 8) & 0xF]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_add_index(machine: Machine, op: int):
+    # FX1E
+    machine.I = (machine.I + machine.registers[(op >> 8) & 0xF]) % 0x10000
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_font(machine: Machine, op: int):
+    # FX29
+    machine.I = font_address(machine.registers[(op >> 8) & 0xF])
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_bcd(machine: Machine, op: int):
+    # FX33
+    vx = machine.registers[(op >> 8) & 0xF]
+    machine.store(machine.I, bytes((vx // 100, (vx % 100) // 10, vx % 10)))
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_store(machine: Machine, op: int):
+    # FX55
+    machine.store(machine.I, machine.registers[:((op >> 8) & 0xF) + 1])
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_load(machine: Machine, op: int):
+    # FX65
+    for i in range(((op >> 8) & 0xF) + 1):
+        machine.registers[i] = machine.memory[machine.I + i]
+    machine.program_counter = machine.program_counter + 2
+
+
+def op_unknown(machine: Machine, op: int):
+    raise ValueError(f"Unknown opcode {hex(op >> 8)}-{hex(op & 0xFF)}")
+
+
+ARITHMETIC_HANDLERS = {
+    0x0: op_assign,
+    0x1: op_or,
+    0x2: op_and,
+    0x3: op_xor,
+    0x4: op_add_registers,
+    0x5: op_subtract,
+    0x6: op_shift_right,
+    0x7: op_subtract_reversed,
+    0x8: op_shift_left,
+}
+
+MISC_HANDLERS = {
+    0x07: op_get_delay_timer,
+    0x0A: op_wait_for_key,
+    0x15: op_set_delay_timer,
+    0x18: op_set_sound_timer,
+    0x1E: op_add_index,
+    0x29: op_font,
+    0x33: op_bcd,
+    0x55: op_store,
+    0x65: op_load,
+}
+
+
+def decode_handler(msb: byte, lsb: byte):
+    """
+        Mirrors the decoding rules of step() and returns the handler for a single opcode.
+    """
+    n0 = msb >> 4
+    n3 = lsb & 0xF
+
+    if n0 == 0x0:
+        if lsb == 0xE0:
+            return op_clear_screen
+        if lsb == 0xEE:
+            return op_return
+        return op_unknown
+    if n0 == 0x1:
+        return op_jump
+    if n0 == 0x2:
+        return op_call
+    if n0 == 0x3:
+        return op_skip_if_equal
+    if n0 == 0x4:
+        return op_skip_if_not_equal
+    if n0 == 0x5:
+        return op_skip_if_registers_equal
+    if n0 == 0x6:
+        return op_set
+    if n0 == 0x7:
+        return op_add
+    if n0 == 0x8:
+        return ARITHMETIC_HANDLERS.get(n3, op_unknown)
+    if n0 == 0x9:
+        return op_skip_if_registers_not_equal if n3 == 0x0 else op_unknown
+    if n0 == 0xA:
+        return op_set_index
+    if n0 == 0xB:
+        return op_jump_offset
+    if n0 == 0xC:
+        return op_random
+    if n0 == 0xD:
+        return op_draw
+    if n0 == 0xE:
+        if lsb == 0x9E:
+            return op_skip_if_key
+        if lsb == 0xA1:
+            return op_skip_if_not_key
+        return op_unknown
+    return MISC_HANDLERS.get(lsb, op_unknown)
+
+
+def build_dispatch_table():
+    # The second nibble never affects which handler is chosen,  so we only need to decode
+    # the 16 x 256 combinations of first nibble and least significant byte.
+    rows = [[decode_handler(n0 << 4, lsb) for lsb in range(0x100)] for n0 in range(0x10)]
+    table = []
+    for msb in range(0x100):
+        table.extend(rows[msb >> 4])
+    return table
+
+
+DISPATCH_TABLE = build_dispatch_table()
+
+
+def table_step(machine: Machine):
+    """
+        Drop in replacement for step() which uses the precomputed DISPATCH_TABLE.
+    """
+    memory = machine.memory
+    program_counter = machine.program_counter
+    op = (memory[program_counter] << 8) | memory[program_counter + 1]
+    DISPATCH_TABLE[op](machine, op)
+
+
+def cached_step(machine: Machine):
+    """
+        As table_step(),  but looks the decoded instruction up in the machine's DecodeCache
+        rather than reading and decoding memory every time.
+    """
+    cache = machine.decode_cache
+    program_counter = machine.program_counter
+    entry = cache.entries[program_counter]
+    if entry is None:
+        cache.misses += 1
+        memory = machine.memory
+        op = (memory[program_counter] << 8) | memory[program_counter + 1]
+        entry = cache.entries[program_counter] = (DISPATCH_TABLE[op], op)
+    else:
+        cache.hits += 1
+
+    handler, op = entry
+    handler(machine, op)
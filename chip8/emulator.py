@@ -0,0 +1,52 @@
+from .backends import Display, Keypad, NullDisplay, NullKeypad, NullSound, Sound
+from .machine import Machine
+from .scheduler import DEFAULT_HZ, run_frame_instructions
+
+
+class Emulator:
+    """
+        A Machine wired up to its backends.  Each call to run_frame() reads the keypad,  runs
+        one 60th of a second of emulation,  presents the display if it changed and starts or
+        stops the sound.
+    """
+
+    def __init__(self, machine: Machine = None, display: Display = None, keypad: Keypad = None,
+                 sound: Sound = None, engine: str = "interpreter", hz: int = DEFAULT_HZ):
+        self.machine = machine if machine is not None else Machine()
+        self.display = display if display is not None else NullDisplay()
+        self.keypad = keypad if keypad is not None else NullKeypad()
+        self.sound = sound if sound is not None else NullSound()
+        self.engine = engine
+        self.hz = hz
+        self.sound_playing = False
+
+    def load_rom(self, filename: str):
+        self.machine.load_rom(filename)
+
+    def load_program(self, program: bytes):
+        self.machine.load_program(program)
+
+    def run_frame(self, limit: int = None) -> int:
+        """
+            Runs a frame,  cut short after limit instructions if given,  and returns how many
+            instructions were executed.
+        """
+        machine = self.machine
+        machine.set_keys(self.keypad.key_state())
+        executed = run_frame_instructions(machine, self.engine, self.hz, limit)
+        if machine.display_dirty:
+            self.display.present(machine)
+            machine.display_dirty = False
+
+        # The tone plays for as long as the sound timer is running.  Look before the tick,  so
+        # setting it to 1 still plays for this frame.
+        playing = machine.sound_timer > 0
+        machine.tick_timers()
+        if playing != self.sound_playing:
+            if playing:
+                self.sound.start()
+            else:
+                self.sound.stop()
+            self.sound_playing = playing
+        self.sound.frame()
+        return executed
@@ -0,0 +1,142 @@
+"""
+    Process farm.
+
+    Runs many headless sessions (a rom,  a random seed,  a key script and an instruction
+    budget) spread over a pool of worker processes,  and streams back a FarmResult for
+    each one as it finishes.
+
+    The roms are copied once into a block of shared memory which every worker attaches to,
+    so jobs only carry the index of their rom rather than its bytes.
+
+        python -m chip8.farm c8games/* --seeds 8 --cycles 200000
+"""
+import argparse
+import os
+import random
+import time
+from multiprocessing import Pool, shared_memory
+from typing import Iterable, Iterator, List, Tuple
+
+from .backends import ScriptedKeypad
+from .emulator import Emulator
+from .machine import display_hash
+from .scheduler import DEFAULT_HZ
+
+
+class FarmJob:
+    def __init__(self, rom: str, seed: int = 0, cycles: int = 100_000,
+                 script: Iterable[Tuple[int, Iterable[int]]] = (), engine: str = "table", hz: int = DEFAULT_HZ):
+        self.rom = rom
+        self.seed = seed
+        self.cycles = cycles
+        self.script = list(script)   # (frame, keys held from that frame) pairs,  see ScriptedKeypad
+        self.engine = engine
+        self.hz = hz
+
+
+class FarmResult:
+    def __init__(self, index: int, job: FarmJob, display_hash: str, registers: List[int], cycles: int,
+                 wall_time: float, error: str = None):
+        self.index = index
+        self.job = job
+        self.display_hash = display_hash
+        self.registers = registers
+        self.cycles = cycles
+        self.wall_time = wall_time
+        self.error = error
+
+    def __str__(self):
+        outcome = self.error if self.error else self.display_hash
+        return (f"{self.job.rom} seed={self.job.seed} cycles={self.cycles} "
+                f"time={self.wall_time:.3f}s {outcome}")
+
+
+# Set in each worker by _attach()
+_roms = None
+_rom_table = None
+
+
+def _attach(name: str, rom_table: List[Tuple[int, int]]):
+    global _roms, _rom_table
+    # Workers share the parent's resource tracker,  so attaching does not take ownership,
+    # the parent unlinks the block once the pool has finished.
+    _roms = shared_memory.SharedMemory(name=name)
+    _rom_table = rom_table
+
+
+def run_job(index: int, rom_index: int, job: FarmJob) -> FarmResult:
+    offset, length = _rom_table[rom_index]
+    random.seed(job.seed)
+    keypad = ScriptedKeypad(job.script)
+    emulator = Emulator(keypad=keypad, engine=job.engine, hz=job.hz)
+    emulator.load_program(bytes(_roms.buf[offset:offset + length]))
+
+    machine = emulator.machine
+    error = None
+    started = time.perf_counter()
+    frame = 0
+    try:
+        while machine.cycles + machine.idle_cycles < job.cycles:
+            keypad.set_frame(frame)
+            # The last frame is cut short so the job stops on its budget exactly
+            emulator.run_frame(limit=job.cycles - machine.cycles - machine.idle_cycles)
+            frame = frame + 1
+    except Exception as e:
+        error = repr(e)
+    wall_time = time.perf_counter() - started
+
+    return FarmResult(index, job, display_hash(machine), list(machine.registers), machine.cycles, wall_time, error)
+
+
+def _run_job(arguments) -> FarmResult:
+    return run_job(*arguments)
+
+
+def run_farm(jobs: List[FarmJob], processes: int = None) -> Iterator[FarmResult]:
+    """
+        Runs the jobs over a pool of processes (one per core by default),  yielding
+        results in the order they finish.  FarmResult.index says which job it was.
+    """
+    paths = sorted({job.rom for job in jobs})
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    rom_table = []
+    offset = 0
+    for image in images:
+        rom_table.append((offset, len(image)))
+        offset = offset + len(image)
+
+    roms = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for (start, length), image in zip(rom_table, images):
+            roms.buf[start:start + length] = image
+
+        rom_indexes = {path: i for i, path in enumerate(paths)}
+        work = [(i, rom_indexes[job.rom], job) for i, job in enumerate(jobs)]
+        with Pool(processes or os.cpu_count(), initializer=_attach, initargs=(roms.name, rom_table)) as pool:
+            yield from pool.imap_unordered(_run_job, work)
+    finally:
+        roms.close()
+        roms.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many headless CHIP-8 sessions in parallel")
+    parser.add_argument("roms", nargs="+")
+    parser.add_argument("--seeds", type=int, default=1, help="sessions per rom,  seeded 0,  1,  2...")
+    parser.add_argument("--cycles", type=int, default=100_000)
+    parser.add_argument("--engine", default="table")
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args()
+
+    jobs = [FarmJob(rom, seed, args.cycles, engine=args.engine) for rom in args.roms for seed in range(args.seeds)]
+    started = time.perf_counter()
+    total = 0
+    for result in run_farm(jobs, args.processes):
+        total = total + result.cycles
+        print(result)
+    elapsed = time.perf_counter() - started
+    print(f"{len(jobs)} sessions,  {total:,} instructions in {elapsed:.2f}s,  {total / elapsed:,.0f} instructions/sec")
@@ -0,0 +1,323 @@
+"""
+    Differential fuzzing.
+
+    Every engine has to leave the machine in exactly the state step() does.  The fuzzer makes
+    random little programs and random machines to run them on (registers,  I,  stack,  timers,
+    keys and display),  runs each with step() and with every other engine,  and compares the
+    whole machine (every field,  memory too) after the same number of instructions.  An
+    instruction which raises must raise the same kind of error in every engine and leave the
+    machine in the same state (only the message is allowed to differ).
+
+    The batched engine is checked too,  as a BatchMachine of one machine copied back out with
+    BatchMachine.machine().  It halts rather than raising,  the error it keeps counts as
+    raised.
+
+    Programs are made of instructions from every family,  with jumps and calls kept inside
+    the program and I pointing anywhere,  so FX55 and friends get to overwrite code that has
+    already been decoded or compiled.  CXNN gets the same random numbers in every engine.
+
+    When an engine disagrees the case is minimised:  cut to the first instruction after which
+    the machines differ,  then every instruction and every piece of state which can be reset
+    without the disagreement going away is reset.  The reproducer is printed and can be saved
+    and run again with --replay.
+
+    step() is the reference as it stands,  quirks and all,  this only checks the other engines
+    agree with it.
+
+        python -m chip8.fuzz --cases 500000
+        python -m chip8.fuzz --replay case.json
+"""
+import argparse
+import json
+import os
+import random
+import time
+from array import array
+from multiprocessing import Pool
+from typing import Iterator, List, Optional
+
+from .analyser import mnemonic
+from .machine import Machine
+from .scheduler import ENGINE_NAMES, run
+
+REFERENCE = "interpreter"
+BATCH = "batch"
+FUZZ_ENGINES = [name for name in ENGINE_NAMES if name != REFERENCE] + [BATCH]
+PROGRAM_LENGTH = 24     # Instructions
+STEPS = 48
+NO_OPERATION = 0x8000   # V0 = V0
+
+# What's compared,  everything a snapshot holds
+STATE = ("program_counter", "I", "stack_pointer", "delay_timer", "sound_timer", "display_dirty", "keys",
+         "waiting_for_key", "cycles", "idle_cycles", "registers", "stack", "display", "memory")
+
+# Each field's width in bits and where it goes in the opcode
+FIELDS = {"x": (4, 8), "y": (4, 4), "n": (4, 0), "nn": (8, 0), "nnn": (12, 0)}
+
+# Opcodes with their fields zeroed,  and the fields to fill in.  A target is an address in the program.
+TEMPLATES = [
+    (0x00E0, ()), (0x00EE, ()), (0x1000, ("target",)), (0x2000, ("target",)),
+    (0x3000, ("x", "nn")), (0x4000, ("x", "nn")), (0x5000, ("x", "y")), (0x6000, ("x", "nn")),
+    (0x7000, ("x", "nn")), (0x8000, ("x", "y")), (0x8001, ("x", "y")), (0x8002, ("x", "y")),
+    (0x8003, ("x", "y")), (0x8004, ("x", "y")), (0x8005, ("x", "y")), (0x8006, ("x", "y")),
+    (0x8007, ("x", "y")), (0x8008, ("x", "y")), (0x800E, ("x", "y")), (0x9000, ("x", "y")),
+    (0xA000, ("nnn",)), (0xB000, ("target",)), (0xC000, ("x", "nn")), (0xD000, ("x", "y", "n")),
+    (0xE09E, ("x",)), (0xE0A1, ("x",)), (0xF007, ("x",)), (0xF00A, ("x",)), (0xF015, ("x",)),
+    (0xF018, ("x",)), (0xF01E, ("x",)), (0xF029, ("x",)), (0xF033, ("x",)), (0xF055, ("x",)),
+    (0xF065, ("x",)),
+]
+
+
+class FuzzCase:
+    """
+        A program and the machine state it starts from.  Everything is plain data,  so cases
+        can be sent to worker processes and saved as json.
+    """
+
+    def __init__(self, seed: int, program: List[int], registers: List[int], I: int, stack: List[int],
+                 stack_pointer: int, delay_timer: int, sound_timer: int, keys: int, display: List[int],
+                 steps: int = STEPS):
+        self.seed = seed
+        self.program = program          # Opcodes,  from 0x200
+        self.registers = registers
+        self.I = I
+        self.stack = stack
+        self.stack_pointer = stack_pointer
+        self.delay_timer = delay_timer
+        self.sound_timer = sound_timer
+        self.keys = keys
+        self.display = display
+        self.steps = steps
+
+    @classmethod
+    def generate(cls, seed: int) -> "FuzzCase":
+        generator = random.Random(seed)
+        end = 0x200 + 2 * PROGRAM_LENGTH
+        program = []
+        for _ in range(PROGRAM_LENGTH):
+            op, fields = generator.choice(TEMPLATES)
+            for field in fields:
+                if field == "target":
+                    op = op | (0x200 + 2 * generator.randrange(PROGRAM_LENGTH))
+                else:
+                    bits, shift = FIELDS[field]
+                    op = op | (generator.getrandbits(bits) << shift)
+            program.append(op)
+        stack_pointer = generator.randrange(17)
+        return cls(seed, program,
+                   registers=list(generator.randbytes(16)),
+                   I=generator.choice([generator.randrange(0x200, end), generator.randrange(4096)]),
+                   stack=[generator.randrange(0x200, end, 2) for _ in range(16)],
+                   stack_pointer=stack_pointer,
+                   delay_timer=generator.choice([0, generator.randrange(256)]),
+                   sound_timer=generator.choice([0, generator.randrange(256)]),
+                   keys=generator.choice([0, generator.randrange(0x10000)]),
+                   display=[generator.getrandbits(64) for _ in range(32)])
+
+    def machine(self) -> Machine:
+        machine = Machine()
+        machine.load_program(b"".join(op.to_bytes(2, "big") for op in self.program))
+        machine.registers[:] = bytes(self.registers)
+        machine.I = self.I
+        machine.stack[:] = array("H", self.stack)
+        machine.stack_pointer = self.stack_pointer
+        machine.delay_timer = self.delay_timer
+        machine.sound_timer = self.sound_timer
+        machine.set_keys(self.keys)
+        machine.display = list(self.display)
+        return machine
+
+    def copy(self, **changes) -> "FuzzCase":
+        fields = dict(self.to_json(), **changes)
+        return FuzzCase(**fields)
+
+    def to_json(self) -> dict:
+        return {"seed": self.seed, "program": list(self.program), "registers": list(self.registers), "I": self.I,
+                "stack": list(self.stack), "stack_pointer": self.stack_pointer, "delay_timer": self.delay_timer,
+                "sound_timer": self.sound_timer, "keys": self.keys, "display": list(self.display),
+                "steps": self.steps}
+
+    def listing(self) -> List[str]:
+        """
+            The program,  leaving out the instructions which do nothing.
+        """
+        return [f"    {0x200 + 2 * i:03X}  {op:04X}  {mnemonic(op)}" for i, op in enumerate(self.program)
+                if op != NO_OPERATION]
+
+
+def run_case(case: FuzzCase, engine: str, steps: int, start: Machine = None) -> tuple:
+    """
+        Runs steps instructions of the case with the engine,  returns the kind of error it
+        raised (or None) and the machine.  start is case.machine(),  copied rather than made
+        again when a case is run with several engines.
+    """
+    random.seed(case.seed)
+    machine = case.machine() if start is None else start.copy()
+    # Compile a block wherever the program lands,  the programs are too short to get hot
+    machine.block_cache.hot = 1
+    if engine == BATCH:
+        return _run_batch(case, machine, steps)
+    try:
+        run(machine, engine, steps)
+    except Exception as e:
+        return type(e).__name__, machine
+    return None, machine
+
+
+def _run_batch(case: FuzzCase, machine: Machine, steps: int) -> tuple:
+    # Imported here as it needs NumPy,  which the rest of the package doesn't
+    from .batch import BatchMachine
+
+    batch = BatchMachine(1, seeds=[case.seed])
+    batch.load_machine(0, machine)
+    batch.run(steps)
+    machine = batch.machine(0)
+    error = batch.errors[0]
+    if error is None:
+        return None, machine
+    # run() raises without counting any of the instructions it ran
+    machine.cycles = machine.idle_cycles = 0
+    return error.partition("(")[0], machine
+
+
+def outcome(case: FuzzCase, engine: str, steps: int, start: Machine = None) -> tuple:
+    """
+        The kind of error running steps instructions of the case with the engine raised
+        (or None),  and the machine's fields after.
+    """
+    error, machine = run_case(case, engine, steps, start)
+    return (error,) + tuple(getattr(machine, name) for name in STATE)
+
+
+def disagrees(case: FuzzCase, engine: str, steps: int = None) -> bool:
+    steps = case.steps if steps is None else steps
+    return outcome(case, engine, steps) != outcome(case, REFERENCE, steps)
+
+
+def check(case: FuzzCase, engines: List[str]) -> List[str]:
+    """
+        The engines which don't end up where step() does.
+    """
+    start = case.machine()
+    expected = outcome(case, REFERENCE, case.steps, start)
+    return [engine for engine in engines if outcome(case, engine, case.steps, start) != expected]
+
+
+def minimise(case: FuzzCase, engine: str) -> FuzzCase:
+    # Stop at the first instruction after which the machines differ
+    steps = next(steps for steps in range(1, case.steps + 1) if disagrees(case, engine, steps))
+    case = case.copy(steps=steps)
+
+    # Replace every instruction we can with one which does nothing
+    for i in range(len(case.program)):
+        if case.program[i] != NO_OPERATION:
+            program = list(case.program)
+            program[i] = NO_OPERATION
+            simpler = case.copy(program=program)
+            if disagrees(simpler, engine):
+                case = simpler
+    while len(case.program) > 1 and case.program[-1] == NO_OPERATION:
+        shorter = case.copy(program=case.program[:-1])
+        if not disagrees(shorter, engine):
+            break
+        case = shorter
+
+    # Then reset as much of the state as we can
+    for name, reset in (("display", [0] * 32), ("keys", 0), ("sound_timer", 0), ("delay_timer", 0),
+                        ("stack", [0] * 16), ("stack_pointer", 0), ("I", 0)):
+        simpler = case.copy(**{name: reset})
+        if disagrees(simpler, engine):
+            case = simpler
+    for register in range(16):
+        if case.registers[register]:
+            registers = list(case.registers)
+            registers[register] = 0
+            simpler = case.copy(registers=registers)
+            if disagrees(simpler, engine):
+                case = simpler
+    return case
+
+
+def describe(case: FuzzCase, engine: str) -> str:
+    lines = [f"{engine} disagrees with {REFERENCE} after {case.steps} instructions of"
+             f" (every other instruction is {NO_OPERATION:04X},  {mnemonic(NO_OPERATION)}):"]
+    lines.extend(case.listing())
+    lines.append(f"  registers {' '.join(f'{value:02X}' for value in case.registers)}  I {case.I:03X}"
+                 f"  stack pointer {case.stack_pointer}  delay {case.delay_timer}  sound {case.sound_timer}"
+                 f"  keys {case.keys:04X}")
+    lines.append(f"  {REFERENCE}: {_summary(*run_case(case, REFERENCE, case.steps))}")
+    lines.append(f"  {engine}: {_summary(*run_case(case, engine, case.steps))}")
+    return "\n".join(lines)
+
+
+def _summary(error: Optional[str], machine: Machine) -> str:
+    error = f"{error},  " if error else ""
+    return (f"{error}pc {machine.program_counter:03X}  I {machine.I:03X}  registers "
+            f"{' '.join(f'{value:02X}' for value in machine.registers)}  stack pointer {machine.stack_pointer}")
+
+
+def _check_seeds(arguments) -> List[tuple]:
+    first, count, engines = arguments
+    failures = []
+    for seed in range(first, first + count):
+        for engine in check(FuzzCase.generate(seed), engines):
+            failures.append((seed, engine))
+    return failures
+
+
+def fuzz(cases: int, engines: List[str], first_seed: int = 0, processes: int = None,
+         chunk: int = 1000) -> Iterator[tuple]:
+    """
+        Checks cases seeded first_seed,  first_seed + 1... over a pool of processes,  yielding
+        (seed,  engine) for every disagreement.
+    """
+    work = [(seed, min(chunk, first_seed + cases - seed), engines)
+            for seed in range(first_seed, first_seed + cases, chunk)]
+    with Pool(processes or os.cpu_count()) as pool:
+        for failures in pool.imap_unordered(_check_seeds, work):
+            yield from failures
+
+
+def replay(filename: str, engines: List[str]) -> Optional[str]:
+    with open(filename) as f:
+        case = FuzzCase(**json.load(f))
+    for engine in check(case, engines):
+        return describe(case, engine)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check every engine against step() on random programs")
+    parser.add_argument("--cases", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first case")
+    parser.add_argument("--engine", action="append", choices=FUZZ_ENGINES,
+                        help="engine to check,  may be repeated (default all)")
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--save", metavar="FILE", help="save the first minimised reproducer as json")
+    parser.add_argument("--replay", metavar="FILE", help="run a saved reproducer")
+    args = parser.parse_args()
+    engines = args.engine or FUZZ_ENGINES
+
+    if args.replay:
+        print(replay(args.replay, engines) or "All engines agree")
+    else:
+        started = time.perf_counter()
+        failures = []
+        for seed, engine in fuzz(args.cases, engines, args.seed, args.processes):
+            failures.append((seed, engine))
+        elapsed = time.perf_counter() - started
+        print(f"{args.cases:,} cases in {elapsed:.1f}s ({args.cases / elapsed * 60:,.0f} a minute),"
+              f"  {len(failures)} disagreements")
+
+        reported = set()
+        for seed, engine in sorted(failures):
+            if engine in reported:
+                continue
+            reported.add(engine)
+            case = minimise(FuzzCase.generate(seed), engine)
+            print()
+            print(f"seed {seed}")
+            print(describe(case, engine))
+            if args.save and len(reported) == 1:
+                with open(args.save, "w") as f:
+                    json.dump(case.to_json(), f)
@@ -0,0 +1,232 @@
+# https://en.wikipedia.org/wiki/CHIP-8
+# http://devernay.free.fr/hacks/chip8/C8TECH10.HTM#font
+import random
+
+from .machine import Machine, draw_sprite, font_address
+
+
+def step(machine: Machine):
+    # Decode straight into locals rather than allocating an OpCode for every instruction
+    msb = machine.memory[machine.program_counter]
+    lsb = machine.memory[machine.program_counter+1]
+    n0 = msb >> 4
+    n1 = msb & 0xF
+    n2 = lsb >> 4
+    n3 = lsb & 0xF
+    # 0nnn
+
+    if n0 == 0x0 and lsb == 0xE0:
+        machine.display = [0] * 32
+        machine.display_dirty = True
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0x0 and lsb == 0xEE:
+        # 00EE #1002:: Running 0x0-0xee
+        machine.program_counter = machine.pop()
+
+    elif n0 == 0x1:
+        # 1NNN	Flow	goto NNN;	Jumps to address NNN.
+        machine.program_counter = (n1 * 256) + \
+            (n2 * 16) + n3
+
+    elif n0 == 0x2:
+        # 2NNN	Flow	*(0xNNN)()	Calls subroutine at NNN.
+        machine.push(machine.program_counter + 2)
+        machine.program_counter = (n1 * 256) + \
+            (n2 * 16) + n3
+
+    elif n0 == 0x3:
+        # 3XNN	Cond	if(Vx==NN)	Skips the next instruction if VX equals NN. (Usually the next instruction is a jump to skip a code block);
+        if machine.registers[n1] == lsb:
+            machine.program_counter = machine.program_counter + 4
+        else:
+            machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0x4:
+        if machine.registers[n1] != lsb:
+            machine.program_counter = machine.program_counter + 4
+        else:
+            machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0x5:
+        if machine.registers[n1] == machine.registers[n2]:
+            machine.program_counter = machine.program_counter + 4
+        else:
+            machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0x6:
+        # Vx = N
+        machine.registers[n1] = lsb
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0x7:
+        # Vx += N
+        machine.registers[n1] = (
+            machine.registers[n1] + lsb) % 0x100
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0x8:
+        if n3 == 0x0:
+            # Assignment
+            machine.registers[n1] = machine.registers[n2]
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x1:
+            # Bitwise or  (Vx=Vx|Vy)
+            machine.registers[n1] = machine.registers[n1] | machine.registers[n2]
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x2:
+            # Bitwise and  (Vx=Vx&Vy)
+            machine.registers[n1] = machine.registers[n1] & machine.registers[n2]
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x3:
+            # Vx=Vx^Vy	Sets VX to VX xor VY.
+            machine.registers[n1] = machine.registers[n1] ^ machine.registers[n2]
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x4:
+            # Vx += V	Adds VY to VX. VF is set to 1 when there's a carry, and to 0 when there is not.
+            total = machine.registers[n1] + machine.registers[n2]
+            machine.registers[n1] = total & 0xFF
+            machine.registers[0xF] = 1 if total > 0xFF else 0
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x5:
+            # Vx -= V
+            difference = machine.registers[n1] - machine.registers[n2]
+            machine.registers[n1] = difference & 0xFF
+            machine.registers[0xF] = 1 if difference < 0x0 else 0
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x6:
+            # Vx>>=1
+            machine.registers[0xF] = machine.registers[n1] & 0b00000001
+            machine.registers[n1] = machine.registers[n1] >> 1
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x7:
+            # Vx=Vy-V
+            X = n1
+            Y = n2
+            difference = machine.registers[Y] - machine.registers[X]
+            machine.registers[X] = difference & 0xFF
+            if difference < 0:
+                #Borrow (underflow?)
+                machine.registers[0xF] = 0
+            else:
+                machine.registers[0xF] = 1
+
+            machine.program_counter = machine.program_counter + 2
+
+        elif n3 == 0x8:
+            # Vx<<=1
+            machine.registers[0xF] = machine.registers[n1] & 0b10000000
+            machine.registers[n1] = (machine.registers[n1] << 1) & 0b11111111
+            machine.program_counter = machine.program_counter + 2
+
+        else:
+            raise ValueError(
+                f"Unknown opcode {hex(msb)}-{hex(lsb)}")
+
+    elif n0 == 0x9 and n3 == 0x0:
+        vx = machine.registers[n1]
+        vy = machine.registers[n2]
+        if vx != vy:
+            machine.program_counter = machine.program_counter + 4
+        else:
+            machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xA:
+        # ANNN	MEM	I = NN	Sets I to the address NNN.
+        machine.I = (n1 * 256) + (n2 * 16) + n3
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xB:
+        # Jumps to the address NNN plus V0.
+        v0 = machine.registers[0x0]
+        address = (n1 * 256) + (n2 * 16) + n3
+        machine.program_counter = address + v0
+
+    elif n0 == 0xC:
+        machine.registers[n1] = random.randint(0, 255) & lsb
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xD:
+        # DXYN	Disp	draw(Vx,Vy,N)
+        # Draws a sprite at coordinate (VX, VY) that has a width of 8 pixels and a height of N+1 pixels.
+        # Each row of 8 pixels is read as bit-coded starting from memory location I; I value does not
+        # change after the execution of this instruction. As described above, VF is set to 1 if any screen pixels
+        #  are flipped from set to unset when the sprite is drawn, and to 0 if that does not happen
+        vX = machine.registers[n1]
+        vY = machine.registers[n2]
+        N = n3
+
+        draw_sprite(machine, vX, vY, N)
+        machine.display_dirty = True
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xE and lsb == 0x9E:
+        key = machine.registers[n1]
+        if (machine.keys >> key) & 1:
+            machine.program_counter = machine.program_counter + 4
+        else:
+            machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xE and lsb == 0xA1:
+        key = machine.registers[n1]
+        if not (machine.keys >> key) & 1:
+            machine.program_counter = machine.program_counter + 4
+        else:
+            machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x07:
+        machine.registers[n1] = machine.delay_timer
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x0A:
+        if machine.keys:
+            # The lowest numbered key which is down
+            machine.registers[n1] = (machine.keys & -machine.keys).bit_length() - 1
+            machine.program_counter = machine.program_counter + 2
+        else:
+            # Park the CPU until a key goes down,  see Machine.set_keys().  The PC is left
+            # on this instruction so that it runs again once a key has been pressed.
+            machine.waiting_for_key = True
+
+    elif n0 == 0xF and lsb == 0x15:
+        machine.delay_timer = machine.registers[n1]
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x18:
+        machine.sound_timer = machine.registers[n1]
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x1E:
+        machine.I = (machine.I + machine.registers[n1]) % 0x10000
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x29:
+        character = machine.registers[n1]
+        machine.I = font_address(character)
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x33:
+        vx = machine.registers[n1]
+        machine.store(machine.I, bytes((vx // 100, (vx % 100) // 10, vx % 10)))
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x55:
+        X = n1
+        machine.store(machine.I, machine.registers[:X+1])
+        machine.program_counter = machine.program_counter + 2
+
+    elif n0 == 0xF and lsb == 0x65:
+        X = n1
+        for i in range(X+1):
+            machine.registers[i] = machine.memory[machine.I + i]
+        machine.program_counter = machine.program_counter + 2
+
+    else:
+        raise ValueError(f"Unknown opcode {hex(msb)}-{hex(lsb)}")
@@ -0,0 +1,147 @@
+"""
+    Rom library.
+
+    An index of a directory of roms,  kept on disk next to them in .index.json,  which records
+    each rom's size,  sha1 and a listing of its instructions.  The listing is the opcode at every
+    even address from 0x200,  which is where a program's instructions normally start,  so it can be
+    used to fill a DecodeCache without decoding the rom again.
+
+    The index is rebuilt for any rom whose size or hash no longer matches.
+
+        python -m chip8.library c8games
+"""
+import argparse
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+from .dispatch import DISPATCH_TABLE
+from .machine import DecodeCache, Machine, mapped_rom
+
+INDEX_FILENAME = ".index.json"
+INDEX_VERSION = 1
+
+
+def decode_listing(program: bytes) -> List[int]:
+    """
+        The 16 bit opcode at each even offset of the program.  A trailing odd byte is ignored.
+    """
+    return [(program[i] << 8) | program[i + 1] for i in range(0, len(program) - 1, 2)]
+
+
+class RomEntry:
+    def __init__(self, name: str, size: int, sha1: str, listing: List[int]):
+        self.name = name
+        self.size = size
+        self.sha1 = sha1
+        self.listing = listing
+
+    def to_json(self) -> dict:
+        return {"size": self.size, "sha1": self.sha1, "listing": self.listing}
+
+    def prime(self, cache: DecodeCache):
+        """
+            Fills the decode cache for the rom's instructions,  as if each had already been run once.
+        """
+        entries = cache.entries
+        address = 0x200
+        for op in self.listing:
+            entries[address] = (DISPATCH_TABLE[op], op)
+            address = address + 2
+
+    def __str__(self):
+        return f"{self.name:<12} {self.size:>5} bytes  {self.sha1}"
+
+
+class RomLibrary:
+    """
+        The roms in one directory.  Each rom is read from disk at most once,  after that
+        load() copies it straight from memory into a machine.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.entries: Dict[str, RomEntry] = {}
+        self.programs: Dict[str, bytes] = {}
+        self.changed = False
+        self._read_index()
+        self._refresh()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get("version") != INDEX_VERSION:
+            return
+        for name, entry in index["roms"].items():
+            self.entries[name] = RomEntry(name, entry["size"], entry["sha1"], entry["listing"])
+
+    def _refresh(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if not name.startswith(".") and os.path.isfile(os.path.join(self.directory, name)))
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+                self.changed = True
+        for name in names:
+            entry = self.entries.get(name)
+            if entry is None or entry.size != os.path.getsize(self.path(name)):
+                self.program(name)
+
+    def _index(self, name: str, program: bytes) -> RomEntry:
+        entry = RomEntry(name, len(program), hashlib.sha1(program).hexdigest(), decode_listing(program))
+        self.entries[name] = entry
+        self.changed = True
+        return entry
+
+    def save(self):
+        index = {"version": INDEX_VERSION,
+                 "roms": {name: entry.to_json() for name, entry in sorted(self.entries.items())}}
+        with open(self.index_path, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        self.changed = False
+
+    def names(self) -> List[str]:
+        return sorted(self.entries)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def program(self, name: str) -> bytes:
+        """
+            The rom's bytes.  The first time a rom is read it is re-indexed if it no longer
+            matches the index.
+        """
+        program = self.programs.get(name)
+        if program is None:
+            with mapped_rom(self.path(name)) as rom:
+                program = self.programs[name] = bytes(rom)
+            entry = self.entries.get(name)
+            if entry is None or entry.sha1 != hashlib.sha1(program).hexdigest():
+                self._index(name, program)
+        return program
+
+    def load(self, machine: Machine, name: str) -> RomEntry:
+        """
+            Loads the rom into the machine and primes its decode cache from the index.
+        """
+        machine.load_program(self.program(name))
+        entry = self.entries[name]
+        entry.prime(machine.decode_cache)
+        return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the index of a directory of roms")
+    parser.add_argument("directory", nargs="?", default="c8games")
+    args = parser.parse_args()
+
+    library = RomLibrary(args.directory)
+    library.save()
+    for name in library.names():
+        print(library.entries[name])
+    print(f"{len(library.entries)} roms indexed in {library.index_path}")
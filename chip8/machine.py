@@ -0,0 +1,312 @@
+import hashlib
+import mmap
+import os
+from array import array
+from contextlib import contextmanager
+from typing import List, NewType
+
+from .font import load_fonts
+
+byte = NewType("byte", int)
+address = byte
+
+
+def _build_boot_image() -> bytes:
+    image = bytearray(4096)
+    load_fonts(image)
+    return bytes(image)
+
+
+# What memory holds before a program is loaded at 0x200,  the font lives in the interpreter area.
+BOOT_IMAGE = _build_boot_image()
+
+
+def boot_image(program: bytes) -> bytearray:
+    """
+        A fresh 4096 byte memory holding the font and the program at 0x200,  built with
+        one bulk copy of each.  program can be anything supporting the buffer protocol.
+    """
+    if 0x200 + len(program) > 4096:
+        raise IndexError("Program is too big to fit in memory")
+    image = bytearray(BOOT_IMAGE)
+    image[0x200:0x200 + len(program)] = program
+    return image
+
+
+@contextmanager
+def mapped_rom(filename: str):
+    """
+        The bytes of a rom file,  memory mapped rather than read into a new bytes object.
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as rom:
+            yield rom
+
+
+class DecodeCache:
+    """
+        Remembers the decoded instruction (handler and opcode) for each address in memory.
+
+        Entries must be invalidated whenever the memory they were decoded from is written,
+        which is why all writes to memory during execution go through Machine.store().
+    """
+
+    def __init__(self):
+        self.entries = [None] * 4096
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, address: address, length: int = 1):
+        # An instruction is two bytes long,  so the one starting just before
+        # the first byte written is affected too.
+        first = max(address - 1, 0)
+        last = min(address + length, 4096)
+        self.entries[first:last] = [None] * (last - first)
+
+    def clear(self):
+        self.entries = [None] * 4096
+
+    def __str__(self):
+        return f"hits = {self.hits}, misses = {self.misses}"
+
+
+class Block:
+    """
+        A run of instructions compiled into a single Python function,  which returns how many
+        of them it ran.  That is length unless it skipped some.  addresses are the bytes of
+        memory it was compiled from.
+    """
+
+    def __init__(self, start: address, addresses: List[address], length: int, run, source: str):
+        self.start = start
+        self.addresses = addresses
+        self.length = length
+        self.run = run
+        self.source = source
+
+
+class BlockCache:
+    """
+        Compiled blocks keyed by their start address.  Writing to any byte a block was
+        compiled from throws that block away.
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.covering = [None] * 4096   # address -> start addresses of the blocks covering it
+        self.landings = [0] * 4096      # address -> times the flow of control landed there
+        self.hot = 16                   # Landings before a block is compiled
+        self.misses = 0
+
+    def add(self, block: Block):
+        self.blocks[block.start] = block
+        for a in block.addresses:
+            if self.covering[a] is None:
+                self.covering[a] = []
+            self.covering[a].append(block.start)
+
+    def invalidate(self, address: address, length: int = 1):
+        # Unlike the DecodeCache a block lists both bytes of every instruction,  so only
+        # the bytes written matter.
+        last = min(address + length, 4096)
+        if not any(self.covering[address:last]):
+            return
+        for a in range(address, last):
+            starts = self.covering[a]
+            if starts:
+                for start in list(starts):
+                    self.remove(start)
+
+    def remove(self, start: address):
+        block = self.blocks.pop(start)
+        for a in block.addresses:
+            self.covering[a].remove(start)
+
+    def clear(self):
+        self.blocks = {}
+        self.covering = [None] * 4096
+        self.landings = [0] * 4096
+
+    def __str__(self):
+        return f"blocks = {len(self.blocks)}, misses = {self.misses}"
+
+
+class Machine:
+    """
+        Memory and the registers are bytearrays,  and the stack is a fixed array of 16 return
+        addresses with a stack pointer,  so every machine has its own compact state which is
+        cheap to copy.  Values written to a bytearray must already be in the range 0-255.
+    """
+    __slots__ = ("program_counter", "memory", "registers", "I", "stack", "stack_pointer", "display",
+                 "display_dirty", "delay_timer", "sound_timer", "keys", "waiting_for_key", "cycles",
+                 "idle_cycles", "decode_cache", "block_cache", "profiler")
+
+    def __init__(self):
+        self.program_counter: address = 0
+        self.memory = bytearray(4096)
+        self.registers = bytearray(0x10)
+        self.I: int = 0  # 16 bits
+        self.stack = array("H", [0] * 16)
+        self.stack_pointer = 0  # Number of return addresses on the stack
+        self.display = [0] * 32   # array of 32 rows,  each row is a 64 bit int with column 0 in the top bit
+        self.display_dirty = False  # Set whenever the display changes,  cleared by whoever presents it
+        self.delay_timer = 0  # Both timers count down at 60 Hz,  see tick_timers()
+        self.sound_timer = 0
+        self.keys = 0  # Bit n is set while key n is down,  see set_keys()
+        self.waiting_for_key = False  # Set by FX0A to park the CPU until a key is pressed
+        self.cycles = 0  # Instructions executed by run()
+        self.idle_cycles = 0  # Instructions run() spent parked in FX0A rather than executing
+        self.decode_cache = DecodeCache()
+        self.block_cache = BlockCache()
+        self.profiler = None  # A chip8.profiler.Profiler while profiling,  see run()
+
+    def copy(self) -> "Machine":
+        """
+            A copy of the machine's state.  The copy starts with empty decode and block caches.
+        """
+        machine = Machine()
+        machine.program_counter = self.program_counter
+        machine.memory[:] = self.memory
+        machine.registers[:] = self.registers
+        machine.I = self.I
+        machine.stack[:] = self.stack
+        machine.stack_pointer = self.stack_pointer
+        machine.display = self.display[:]
+        machine.display_dirty = self.display_dirty
+        machine.delay_timer = self.delay_timer
+        machine.sound_timer = self.sound_timer
+        machine.keys = self.keys
+        machine.waiting_for_key = self.waiting_for_key
+        machine.cycles = self.cycles
+        machine.idle_cycles = self.idle_cycles
+        return machine
+
+    def set_keys(self, keys: int):
+        """
+            Sets which of the 16 keys are down (bit n for key n),  and wakes the CPU up if it
+            is waiting for a key.  Called once a frame from the keypad.
+        """
+        self.keys = keys
+        if keys:
+            self.waiting_for_key = False
+
+    def push(self, return_address: address):
+        if self.stack_pointer == 16:
+            raise ValueError("Stack overflow")
+        self.stack[self.stack_pointer] = return_address
+        self.stack_pointer = self.stack_pointer + 1
+
+    def pop(self) -> address:
+        if self.stack_pointer == 0:
+            raise ValueError("Stack underflow")
+        self.stack_pointer = self.stack_pointer - 1
+        return self.stack[self.stack_pointer]
+
+    def store(self, address: address, values: bytes):
+        """
+            Writes values to memory starting at address,  keeping the decode cache in step.
+        """
+        if address + len(values) > 4096:
+            raise IndexError("Write past the end of memory")
+        self.decode_cache.invalidate(address, len(values))
+        self.block_cache.invalidate(address, len(values))
+        self.memory[address:address + len(values)] = values
+
+    def tick_timers(self):
+        """
+            Counts the delay and sound timers down by one 60 Hz tick.
+        """
+        if self.delay_timer > 0:
+            self.delay_timer = self.delay_timer - 1
+        if self.sound_timer > 0:
+            self.sound_timer = self.sound_timer - 1
+
+    def load_rom(self, filename: str):
+        with mapped_rom(filename) as rom:
+            self.load_program(rom)
+
+    def load_program(self, program: bytes):
+        """
+            Resets memory to the font plus program at 0x200 and starts the program.
+        """
+        self.memory = boot_image(program)
+        self.program_counter = 0x200
+        self.decode_cache.clear()
+        self.block_cache.clear()
+
+    def __str__(self):
+        line = f"program_counter = {self.program_counter}\r\n"
+        line = line + f"I = {self.I}\r\n"
+        line = line + f"registers = {list(self.registers)}\r\n"
+        return line
+
+
+class OpCode():
+    """
+        Given the memory ABCD:
+            + The most significant byte (msb) would be AB
+            + This is split into two nibbles n0 = A and n1 = B
+            + The least significant byte (lsb) would be CD
+            + This is split into two nibbles n2 = C and n3 = D
+    """
+
+    def __init__(self, memory: bytes, program_counter: address):
+        self.msb = memory[program_counter]
+        self.lsb = memory[program_counter+1]
+        self.n0 = self.msb >> 4
+        self.n1 = self.msb & 0xF
+        self.n2 = self.lsb >> 4
+        self.n3 = self.lsb & 0xF
+
+    def __str__(self):
+        return f"{hex(self.msb)}-{hex(self.lsb)}"
+
+
+FULL_ROW = (1 << 64) - 1
+
+
+def pixel(machine: Machine, row: int, column: int) -> bool:
+    return (machine.display[row] >> (63 - column)) & 1 == 1
+
+
+def display_hash(machine: Machine) -> str:
+    """
+        A short fingerprint of what is on the display,  for comparing runs.
+    """
+    return hashlib.sha1(b"".join(row.to_bytes(8, "big") for row in machine.display)).hexdigest()
+
+
+def display_screen(machine: Machine):
+    print('=' * 64)
+    for row in range(32):
+        print(format(machine.display[row], "064b").replace("0", " ").replace("1", "*"))
+    print('=' * 64)
+
+
+def draw_sprite(machine: Machine, vX: int, vY: int, N: int):
+    """
+        XORs the N byte sprite at I onto the display at (vX, vY),  wrapping around the edges.
+        Each sprite row is rotated into place in a single 64 bit value,  so one AND tells us
+        whether any lit pixel is being turned off and one XOR draws the row.
+    """
+    display = machine.display
+    memory = machine.memory
+    shift = vX % 64
+    machine.registers[0xF] = 0
+    for row in range(0, N):
+        bits = memory[machine.I + row] << 56
+        bits = ((bits >> shift) | (bits << (64 - shift))) & FULL_ROW
+        line = (row + vY) % 32
+        if display[line] & bits:
+            # At least one pixel is being flipped from 1 to 0
+            machine.registers[0xF] = 1
+        display[line] = display[line] ^ bits
+
+
+def font_address(character: int) -> int:
+    # Each font takes 5 bytes (memory locations)
+    return character * 5
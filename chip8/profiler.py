@@ -0,0 +1,160 @@
+"""
+    Profiling.
+
+    Setting machine.profiler to a Profiler turns profiling on,  setting it back to None turns
+    it off.  run() only looks at machine.profiler once per batch of instructions,  so leaving
+    it off costs nothing per instruction.
+
+    While profiling,  instructions are run one at a time through the DISPATCH_TABLE handlers
+    (whichever engine was asked for) and the profiler records:
+
+        + how many times each kind of instruction ran and how long it took in total
+        + how many times each address was executed (the hot spots)
+        + draws,  when the sound starts and stops,  and every time the delay or sound timer is set
+        + when each subroutine was called and returned,  for the trace
+
+    summary() is a table of the above,  and write_trace() writes a Chrome trace event file
+    (open it in chrome://tracing,  https://ui.perfetto.dev or https://www.speedscope.app)
+    with a bar for every frame and every subroutine call.
+
+        python -m chip8.profiler c8games/INVADERS --instructions 200000 --trace invaders.json
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from .dispatch import DISPATCH_TABLE, op_call, op_draw, op_return, op_set_delay_timer, op_set_sound_timer
+from .emulator import Emulator
+from .machine import Machine
+
+MAX_TRACE_EVENTS = 1_000_000
+
+
+class Profiler:
+    def __init__(self):
+        self.counts = {}        # handler -> instructions run
+        self.times = {}         # handler -> total nanoseconds
+        self.hot_addresses = [0] * 4096
+        self.draws = 0
+        self.sound_starts = 0
+        self.sounding = False
+        self.timer_events = []  # (cycle, "delay" or "sound", value)
+        self.instructions = 0
+        self.started = time.perf_counter_ns()
+        self.trace_events = []
+        self.calls = []         # (address called,  start time) for each subroutine we are in
+
+    def _timestamp(self, now: int) -> float:
+        # Trace timestamps are in microseconds
+        return (now - self.started) / 1000
+
+    def _trace(self, event: dict):
+        if len(self.trace_events) < MAX_TRACE_EVENTS:
+            self.trace_events.append(event)
+
+    def run(self, machine: Machine, instructions: int) -> int:
+        counts = self.counts
+        times = self.times
+        hot_addresses = self.hot_addresses
+        clock = time.perf_counter_ns
+        frame_started = clock()
+
+        # The sound timer only counts down between frames,  so looking once a batch is enough
+        if (machine.sound_timer > 0) != self.sounding:
+            self.sounding = not self.sounding
+            if self.sounding:
+                self.sound_starts = self.sound_starts + 1
+            self._trace({"name": "sound on" if self.sounding else "sound off", "ph": "i", "s": "g",
+                         "pid": 1, "tid": 0, "ts": self._timestamp(frame_started)})
+
+        ran = instructions
+        for executed in range(instructions):
+            program_counter = machine.program_counter
+            memory = machine.memory
+            op = (memory[program_counter] << 8) | memory[program_counter + 1]
+            handler = DISPATCH_TABLE[op]
+
+            started = clock()
+            handler(machine, op)
+            finished = clock()
+
+            counts[handler] = counts.get(handler, 0) + 1
+            times[handler] = times.get(handler, 0) + finished - started
+            hot_addresses[program_counter] = hot_addresses[program_counter] + 1
+            self.instructions = self.instructions + 1
+
+            if handler is op_draw:
+                self.draws = self.draws + 1
+            elif handler is op_call:
+                self.calls.append((op & 0xFFF, started))
+            elif handler is op_return and self.calls:
+                address, called = self.calls.pop()
+                self._trace({"name": f"sub {address:03X}", "ph": "X", "pid": 1, "tid": 1,
+                             "ts": self._timestamp(called), "dur": (finished - called) / 1000})
+            elif handler is op_set_delay_timer or handler is op_set_sound_timer:
+                kind = "delay" if handler is op_set_delay_timer else "sound"
+                value = machine.delay_timer if kind == "delay" else machine.sound_timer
+                self.timer_events.append((machine.cycles + executed, kind, value))
+                self._trace({"name": f"{kind} timer = {value}", "ph": "i", "s": "t", "pid": 1, "tid": 1,
+                             "ts": self._timestamp(finished)})
+
+            if machine.waiting_for_key:
+                # FX0A parked the CPU,  run() counts the rest as idle
+                ran = executed + 1
+                break
+
+        self._trace({"name": "frame", "ph": "X", "pid": 1, "tid": 0,
+                     "ts": self._timestamp(frame_started), "dur": (clock() - frame_started) / 1000})
+        return ran
+
+    def hottest(self, count: int = 10) -> List[int]:
+        addresses = [a for a in range(4096) if self.hot_addresses[a]]
+        return sorted(addresses, key=lambda a: -self.hot_addresses[a])[:count]
+
+    def summary(self) -> str:
+        total_time = sum(self.times.values()) or 1
+        lines = [f"{'instruction':<34} {'count':>10} {'%':>6} {'time ms':>10} {'%':>6} {'ns each':>8}"]
+        for handler in sorted(self.counts, key=lambda h: -self.times[h]):
+            count = self.counts[handler]
+            spent = self.times[handler]
+            lines.append(f"{handler.__name__:<34} {count:>10,} {100 * count / self.instructions:>6.1f}"
+                         f" {spent / 1e6:>10.2f} {100 * spent / total_time:>6.1f} {spent / count:>8.0f}")
+        lines.append("")
+        lines.append("hottest addresses")
+        for address in self.hottest():
+            lines.append(f"  {address:03X}  {self.hot_addresses[address]:>10,}"
+                         f"  {100 * self.hot_addresses[address] / self.instructions:>5.1f}%")
+        lines.append("")
+        sound_sets = sum(1 for _, kind, _ in self.timer_events if kind == "sound")
+        lines.append(f"{self.instructions:,} instructions,  {self.draws:,} draws,  {self.sound_starts:,} sounds,  "
+                     f"{len(self.timer_events) - sound_sets:,} delay timer sets,  {sound_sets:,} sound timer sets")
+        return "\n".join(lines)
+
+    def write_trace(self, filename: str):
+        trace = {"traceEvents": [{"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "frames"}},
+                                 {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "cpu"}}]
+                 + self.trace_events,
+                 "displayTimeUnit": "ms"}
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile a rom running headless")
+    parser.add_argument("rom")
+    parser.add_argument("--instructions", type=int, default=100_000)
+    parser.add_argument("--trace", metavar="FILE", help="write a Chrome trace event file")
+    args = parser.parse_args()
+
+    emulator = Emulator()
+    emulator.load_rom(args.rom)
+    profiler = emulator.machine.profiler = Profiler()
+    try:
+        while emulator.machine.cycles + emulator.machine.idle_cycles < args.instructions:
+            emulator.run_frame()
+    except Exception as e:
+        print(f"Stopped by {e!r}")
+    print(profiler.summary())
+    if args.trace:
+        profiler.write_trace(args.trace)
@@ -0,0 +1,99 @@
+"""
+    Scheduling.
+
+    The display is presented at most FRAME_RATE times a second.  Between frames we run a
+    batch of instructions sized from the requested CPU speed,  or,  when the speed is
+    unlimited,  as many instructions as fit into the frame.
+
+    The timers tick once at the end of every frame.  With a fixed speed a frame is a fixed
+    number of instructions,  so the timers depend only on how many instructions have run
+    and a run is reproducible.  Only the unlimited speed reads the clock,  and then only
+    once per batch.
+"""
+import time
+
+from .dispatch import cached_step, table_step
+from .interpreter import step
+from .machine import Machine
+from .translator import run_blocks
+
+ENGINES = {
+    "interpreter": step,
+    "table": table_step,
+    "cached": cached_step,
+}
+
+ENGINE_NAMES = list(ENGINES) + ["blocks"]
+
+
+def run(machine: Machine, engine: str, instructions: int) -> int:
+    """
+        Runs the given number of instructions with the named engine (one of ENGINES,
+        or "blocks") and returns how many were executed.  While the machine has a
+        profiler it runs them instead.
+
+        Once FX0A has parked the CPU waiting for a key nothing more is run.  The rest of the
+        instructions are counted in machine.idle_cycles rather than machine.cycles,  the CPU
+        is idling rather than stopped,  so a frame is still as long as ever.
+    """
+    if machine.waiting_for_key:
+        executed = 0
+    elif machine.profiler is not None:
+        executed = machine.profiler.run(machine, instructions)
+    elif engine == "blocks":
+        executed = run_blocks(machine, instructions)
+    else:
+        engine_step = ENGINES[engine]
+        executed = instructions
+        for count in range(1, instructions + 1):
+            engine_step(machine)
+            if machine.waiting_for_key:
+                executed = count
+                break
+
+    machine.cycles = machine.cycles + executed
+    machine.idle_cycles = machine.idle_cycles + instructions - executed
+    return executed
+
+
+FRAME_RATE = 60
+DEFAULT_HZ = 1000
+UNLIMITED_BATCH = 1000
+
+
+def instructions_per_frame(hz: int) -> int:
+    return max(1, round(hz / FRAME_RATE))
+
+
+def run_frame_instructions(machine: Machine, engine: str, hz: int, limit: int = None) -> int:
+    """
+        Runs one frame's worth of instructions at hz instructions per second (0 for
+        unlimited),  without ticking the timers,  and returns how many were executed.
+        With a limit the frame is cut short after that many instructions,  counting any
+        spent waiting for a key.
+    """
+    if hz:
+        instructions = instructions_per_frame(hz)
+        if limit is not None:
+            instructions = min(instructions, limit)
+        return run(machine, engine, instructions)
+    deadline = time.perf_counter() + 1 / FRAME_RATE
+    executed = 0
+    left = limit
+    while time.perf_counter() < deadline and not machine.waiting_for_key and left != 0:
+        batch = UNLIMITED_BATCH if left is None else min(UNLIMITED_BATCH, left)
+        executed = executed + run(machine, engine, batch)
+        if left is not None:
+            left = left - batch
+    return executed
+
+
+def run_frame(machine: Machine, engine: str, hz: int, limit: int = None) -> int:
+    """
+        Runs one frame's worth of instructions at hz instructions per second (0 for
+        unlimited),  at most limit of them,  then ticks the timers,  and returns how many
+        were executed.
+    """
+    executed = run_frame_instructions(machine, engine, hz, limit)
+    machine.tick_timers()
+    return executed
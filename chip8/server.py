@@ -0,0 +1,275 @@
+"""
+    Network server.
+
+    Hosts many sessions,  each an Emulator running one rom,  on a single asyncio event loop.
+    Every 1/60th of a second each session runs one frame,  then every client watching it is
+    sent the rows of the display which changed since the last frame that client was sent.
+    Clients send back the state of their keypad.  Several clients can join the same session,
+    the keys they hold are combined.
+
+    Messages in both directions are a header of type (1 byte) and length (4 bytes,  little
+    endian) followed by that many bytes of payload:
+
+        JOIN   client -> server   json {"session": name,  "rom": rom name}.  Joins the session,
+                                  starting it with the rom if it isn't already running.
+        KEYS   client -> server   2 bytes,  the 16 bit key state (bit n set while key n is down)
+        FRAME  server -> client   frame number (4 bytes),  flags (1 byte) and the changed rows,
+                                  each a row number (1 byte) and the row (8 bytes,  big endian,
+                                  column 0 in the top bit).  The rows are zlib compressed when
+                                  the COMPRESSED flag is set.  The first frame has every row,
+                                  a frame in which nothing changed has none.
+        ERROR  server -> client   utf-8 text,  for a bad request or a session that has stopped
+
+    Slow clients don't hold anyone else up.  Each client has its own sender,  which only ever
+    sends the latest display,  so while a client's connection is backed up the frames it
+    can't take are merged into the next one it can.
+
+        python -m chip8.server --port 8064
+"""
+import argparse
+import asyncio
+import json
+import zlib
+from struct import Struct
+from typing import Dict, List
+
+from .backends import Keypad
+from .emulator import Emulator
+from .library import RomLibrary
+from .scheduler import DEFAULT_HZ, FRAME_RATE
+
+JOIN = 1
+KEYS = 2
+FRAME = 3
+ERROR = 4
+
+HEADER = Struct("<BI")
+FRAME_HEADER = Struct("<IB")
+ROW = Struct(">BQ")
+COMPRESSED = 1
+MAX_MESSAGE = 64 * 1024
+WRITE_BUFFER_LIMIT = 16 * 1024    # Bytes queued for a client before we wait for it to catch up
+
+
+def encode_message(kind: int, payload: bytes) -> bytes:
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+async def read_message(reader: asyncio.StreamReader):
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_MESSAGE:
+        raise ValueError(f"Message of {length} bytes is too long")
+    return kind, await reader.readexactly(length)
+
+
+def encode_frame(frame: int, old_display: List[int], new_display: List[int]) -> bytes:
+    rows = b"".join(ROW.pack(row, new_display[row]) for row in range(32) if new_display[row] != old_display[row])
+    compressed = zlib.compress(rows, 1)
+    if len(compressed) < len(rows):
+        return FRAME_HEADER.pack(frame, COMPRESSED) + compressed
+    return FRAME_HEADER.pack(frame, 0) + rows
+
+
+def apply_frame(display: List[int], payload: bytes) -> int:
+    """
+        Updates display (32 rows) from a FRAME payload and returns the frame number.
+    """
+    frame, flags = FRAME_HEADER.unpack_from(payload)
+    rows = payload[FRAME_HEADER.size:]
+    if flags & COMPRESSED:
+        rows = zlib.decompress(rows)
+    for row, bits in ROW.iter_unpack(rows):
+        display[row] = bits
+    return frame
+
+
+class Subscriber:
+    """
+        One client's connection,  and what it was last sent.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        writer.transport.set_write_buffer_limits(WRITE_BUFFER_LIMIT)
+        self.keys = 0
+        self.session = None
+        self.sent_display = [-1] * 32   # Matches nothing,  so the first frame has every row
+        self.frame_ready = asyncio.Event()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    async def send_frames(self):
+        try:
+            while True:
+                await self.frame_ready.wait()
+                self.frame_ready.clear()
+                session = self.session
+                if session.error:
+                    self.writer.write(encode_message(ERROR, session.error.encode()))
+                    await self.writer.drain()
+                    return
+                # Sent even when no rows changed,  so the client can keep count of the frames
+                display = session.emulator.machine.display
+                message = encode_message(FRAME, encode_frame(session.frame, self.sent_display, display))
+                self.sent_display = display[:]
+                self.writer.write(message)
+                self.frames_sent = self.frames_sent + 1
+                self.bytes_sent = self.bytes_sent + len(message)
+                # Only this client waits here if its connection is backed up
+                await self.writer.drain()
+        except ConnectionError:
+            # The client went away,  handle_client() tidies up when its read fails
+            pass
+
+
+class Session(Keypad):
+    """
+        One running rom and the clients watching it.  The session is its emulator's keypad,
+        a key is down while any of the clients is holding it.
+    """
+
+    def __init__(self, name: str, rom: str, engine: str, hz: int):
+        self.name = name
+        self.rom = rom
+        self.emulator = Emulator(keypad=self, engine=engine, hz=hz)
+        self.subscribers: List[Subscriber] = []
+        self.frame = 0
+        self.error = None
+
+    def key_state(self) -> int:
+        keys = 0
+        for subscriber in self.subscribers:
+            keys = keys | subscriber.keys
+        return keys
+
+    def run_frame(self):
+        try:
+            self.emulator.run_frame()
+        except Exception as e:
+            self.error = f"Session {self.name} stopped: {e!r}"
+        self.frame = self.frame + 1
+        for subscriber in self.subscribers:
+            subscriber.frame_ready.set()
+
+
+class Server:
+    def __init__(self, library: RomLibrary, engine: str = "table", hz: int = DEFAULT_HZ):
+        self.library = library
+        self.engine = engine
+        self.hz = hz
+        self.sessions: Dict[str, Session] = {}
+        self.runner = None
+        self.clients = {}       # The task handling each connection -> its writer
+
+    def join(self, subscriber: Subscriber, request: dict) -> Session:
+        name = request["session"]
+        session = self.sessions.get(name)
+        if session is None:
+            rom = request["rom"]
+            if rom not in self.library.entries:
+                raise ValueError(f"Unknown rom {rom}")
+            session = Session(name, rom, self.engine, self.hz)
+            self.library.load(session.emulator.machine, rom)
+            self.sessions[name] = session
+        session.subscribers.append(subscriber)
+        subscriber.session = session
+        # Send the display as it is now,  rather than waiting for the next frame
+        subscriber.frame_ready.set()
+        return session
+
+    def leave(self, subscriber: Subscriber):
+        session = subscriber.session
+        if session is None:
+            return
+        session.subscribers.remove(subscriber)
+        if not session.subscribers:
+            del self.sessions[session.name]
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriber = Subscriber(writer)
+        sender = None
+        task = asyncio.current_task()
+        self.clients[task] = writer
+        try:
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == JOIN and subscriber.session is None:
+                    self.join(subscriber, json.loads(payload))
+                    sender = asyncio.ensure_future(subscriber.send_frames())
+                elif kind == KEYS and len(payload) == 2:
+                    subscriber.keys = int.from_bytes(payload, "little")
+                else:
+                    raise ValueError(f"Unexpected message {kind}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Disconnected,  possibly part way through a message
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            if not writer.is_closing():
+                writer.write(encode_message(ERROR, str(e).encode()))
+        finally:
+            if sender is not None:
+                sender.cancel()
+            self.leave(subscriber)
+            self.clients.pop(task, None)
+            writer.close()
+
+    async def run_sessions(self):
+        """
+            Runs a frame of every session 60 times a second,  for ever.
+        """
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        while True:
+            for session in list(self.sessions.values()):
+                if session.error is None:
+                    session.run_frame()
+            next_frame = next_frame + 1 / FRAME_RATE
+            delay = next_frame - loop.time()
+            if delay < 0:
+                # We've fallen behind,  don't try to catch up
+                next_frame = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8064) -> asyncio.AbstractServer:
+        """
+            Starts listening and running sessions in the background.  Port 0 picks a free port,
+            server.sockets[0].getsockname() says which.
+        """
+        server = await asyncio.start_server(self.handle_client, host, port)
+        self.runner = asyncio.ensure_future(self.run_sessions())
+        return server
+
+    async def stop(self, server: asyncio.AbstractServer):
+        """
+            Stops listening and running sessions,  and disconnects every client.
+        """
+        server.close()
+        self.runner.cancel()
+        # Every connection,  not just those in a session,  or one which never joined is
+        # left waiting for its first message.  Each handler sees the end of its stream.
+        for writer in self.clients.values():
+            writer.close()
+        await asyncio.gather(self.runner, *self.clients, return_exceptions=True)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8064):
+        server = await self.start(host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop(server)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve CHIP-8 sessions over the network")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8064)
+    parser.add_argument("--roms", default="c8games")
+    parser.add_argument("--engine", default="table")
+    args = parser.parse_args()
+
+    print(f"Serving the roms in {args.roms} on {args.host}:{args.port}")
+    try:
+        asyncio.run(Server(RomLibrary(args.roms), args.engine).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
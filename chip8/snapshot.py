@@ -0,0 +1,199 @@
+"""
+    Snapshots.
+
+    save_snapshot() packs everything about a machine (program counter,  I,  registers,  stack,
+    timers,  display and memory) into one fixed size buffer,  and load_snapshot() copies one
+    back.  Both are straight copies of a fixed amount of data,  however the machine got there.
+
+    The buffer starts with a magic number and a format version,  so it can be written to disk
+    and refused later if the format has changed:
+
+        header      "C8SN",  version                    6 bytes
+        core        see CORE below                      331 bytes
+        memory                                          4096 bytes
+
+    Rewind keeps a ring buffer of recent states for stepping backwards.  Only the pages of
+    memory which changed since the previous entry are stored,  with a complete copy of memory
+    every keyframe_interval entries so that restoring never has far to go.
+"""
+from array import array
+from collections import deque
+from struct import Struct
+from typing import Dict
+
+from .machine import Machine
+
+SNAPSHOT_MAGIC = b"C8SN"
+SNAPSHOT_VERSION = 3
+
+HEADER = Struct("<4sH")
+# program_counter,  I,  stack_pointer,  delay_timer,  sound_timer,  display_dirty,  keys,
+# waiting_for_key,  cycles,  idle_cycles,  registers,  stack (16 return addresses),  display (32 rows)
+# Version 2 added keys and waiting_for_key,  version 3 idle_cycles.
+CORE = Struct("<HHBBBBHBQQ16s16H32Q")
+MEMORY_OFFSET = HEADER.size + CORE.size
+SNAPSHOT_SIZE = MEMORY_OFFSET + 4096
+
+PAGE_SIZE = 256
+PAGES = 4096 // PAGE_SIZE
+
+
+def _pack_core(machine: Machine) -> bytes:
+    return CORE.pack(machine.program_counter, machine.I, machine.stack_pointer, machine.delay_timer,
+                     machine.sound_timer, machine.display_dirty, machine.keys, machine.waiting_for_key,
+                     machine.cycles, machine.idle_cycles, bytes(machine.registers), *machine.stack,
+                     *machine.display)
+
+
+def _unpack_core(machine: Machine, data: bytes, offset: int):
+    values = CORE.unpack_from(data, offset)
+    (machine.program_counter, machine.I, machine.stack_pointer, machine.delay_timer, machine.sound_timer,
+     display_dirty, machine.keys, waiting_for_key, machine.cycles, machine.idle_cycles, registers) = values[:11]
+    machine.display_dirty = bool(display_dirty)
+    machine.waiting_for_key = bool(waiting_for_key)
+    machine.registers[:] = registers
+    machine.stack[:] = array("H", values[11:27])
+    machine.display = list(values[27:59])
+
+
+def _restore_memory(machine: Machine, memory: bytes):
+    # Only the pages which differ are written,  through store() so that whatever was
+    # decoded or compiled from them is thrown away.
+    if machine.memory == memory:
+        return
+    for page in range(PAGES):
+        start = page * PAGE_SIZE
+        contents = memory[start:start + PAGE_SIZE]
+        if machine.memory[start:start + PAGE_SIZE] != contents:
+            machine.store(start, contents)
+
+
+def save_snapshot(machine: Machine) -> bytes:
+    return HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION) + _pack_core(machine) + machine.memory
+
+
+def load_snapshot(machine: Machine, data: bytes):
+    if len(data) != SNAPSHOT_SIZE:
+        raise ValueError(f"A snapshot is {SNAPSHOT_SIZE} bytes,  not {len(data)}")
+    magic, version = HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {version} is not supported,  expected {SNAPSHOT_VERSION}")
+    _unpack_core(machine, data, HEADER.size)
+    _restore_memory(machine, data[MEMORY_OFFSET:])
+
+
+def write_snapshot(filename: str, machine: Machine):
+    with open(filename, "wb") as f:
+        f.write(save_snapshot(machine))
+
+
+def read_snapshot(filename: str, machine: Machine):
+    with open(filename, "rb") as f:
+        load_snapshot(machine, f.read())
+
+
+class RewindEntry:
+    """
+        One recorded state.  A keyframe holds all of memory,  otherwise pages maps the index
+        of each page which changed since the previous entry to its new contents.
+    """
+
+    def __init__(self, core: bytes, memory: bytes = None, pages: Dict[int, bytes] = None):
+        self.core = core
+        self.memory = memory
+        self.pages = pages
+
+    def size(self) -> int:
+        if self.memory is not None:
+            return len(self.core) + len(self.memory)
+        return len(self.core) + PAGE_SIZE * len(self.pages)
+
+
+class Rewind:
+    """
+        A ring buffer of the last capacity states of a machine.  Call record() once a frame
+        (or however often you like) and rewind() to go back.
+    """
+
+    def __init__(self, capacity: int = 600, keyframe_interval: int = 60):
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self.entries = deque()
+        self.last_memory = None    # memory as of the newest entry
+        self.since_keyframe = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, machine: Machine):
+        memory = machine.memory
+        last = self.last_memory
+        if last is None or self.since_keyframe + 1 >= self.keyframe_interval:
+            entry = RewindEntry(_pack_core(machine), memory=bytes(memory))
+            self.since_keyframe = 0
+        else:
+            pages = {}
+            if memory != last:
+                for page in range(PAGES):
+                    start = page * PAGE_SIZE
+                    if memory[start:start + PAGE_SIZE] != last[start:start + PAGE_SIZE]:
+                        pages[page] = bytes(memory[start:start + PAGE_SIZE])
+            entry = RewindEntry(_pack_core(machine), pages=pages)
+            self.since_keyframe = self.since_keyframe + 1
+        self.last_memory = bytes(memory) if entry.memory is None else entry.memory
+        self.entries.append(entry)
+
+        if len(self.entries) > self.capacity:
+            oldest = self.entries.popleft()
+            following = self.entries[0]
+            if following.memory is None:
+                # The oldest entry was what the next one's pages were relative to,  so
+                # promote the next one to a keyframe before letting it go.
+                following.memory = self._apply(bytearray(oldest.memory), [following])
+                following.pages = None
+
+    def _apply(self, memory: bytearray, entries) -> bytes:
+        for entry in entries:
+            for page, contents in entry.pages.items():
+                memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] = contents
+        return bytes(memory)
+
+    def memory_at(self, index: int) -> bytes:
+        """
+            Rebuilds memory as it was for entries[index],  starting from the keyframe before it.
+        """
+        keyframe = index
+        while self.entries[keyframe].memory is None:
+            keyframe = keyframe - 1
+        if keyframe == index:
+            return self.entries[index].memory
+        deltas = [self.entries[i] for i in range(keyframe + 1, index + 1)]
+        return self._apply(bytearray(self.entries[keyframe].memory), deltas)
+
+    def rewind(self, machine: Machine, steps: int = 1):
+        """
+            Restores the state recorded steps entries before the newest (0 is the newest),  and
+            forgets everything recorded after it.
+        """
+        if not 0 <= steps < len(self.entries):
+            raise IndexError(f"Can only rewind up to {len(self.entries) - 1} steps")
+        index = len(self.entries) - 1 - steps
+        memory = self.memory_at(index)
+        entry = self.entries[index]
+        _unpack_core(machine, entry.core, 0)
+        _restore_memory(machine, memory)
+
+        for _ in range(steps):
+            self.entries.pop()
+        self.last_memory = memory
+        self.since_keyframe = 0
+        while self.entries[-1 - self.since_keyframe].memory is None:
+            self.since_keyframe = self.since_keyframe + 1
+
+    def size(self) -> int:
+        """
+            Bytes held,  not counting Python's own overheads.
+        """
+        return sum(entry.size() for entry in self.entries)
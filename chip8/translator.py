@@ -0,0 +1,240 @@
+"""
+    Block translator.
+
+    Starting from a program counter we decode instructions and turn them into Python source,
+    compiled into a single function,  until we reach a return,  a computed jump,  a wait for
+    a key or a write to memory.  Jumps and calls are followed,  the block carries on from
+    their target.  A skip becomes an if statement around the instruction it skips,  and a
+    skip over a jump becomes a branch which leaves the block if it skips and follows the jump
+    if not.  The instruction which ends the block is handed to its handler from the
+    DISPATCH_TABLE,  so the whole block runs with one call.  Blocks stop after at most
+    MAX_BLOCK_LENGTH instructions,  so loops are unrolled a few times.  A block is given the
+    number of instructions left to run and stops part way through when they run out,  so the
+    same block serves wherever the frame boundary falls.
+
+    If an instruction raises part way through a block the machine is left as step() would
+    leave it:  the instructions before it have run and the program counter points at it.
+"""
+import random
+from typing import List
+
+from .dispatch import (DISPATCH_TABLE, cached_step, op_add, op_add_index, op_add_registers, op_and, op_assign,
+                       op_call, op_clear_screen, op_draw, op_font, op_get_delay_timer, op_jump, op_load, op_or,
+                       op_random, op_set, op_set_delay_timer, op_set_index, op_set_sound_timer,
+                       op_shift_left, op_shift_right, op_skip_if_equal, op_skip_if_key,
+                       op_skip_if_not_equal, op_skip_if_not_key, op_skip_if_registers_equal,
+                       op_skip_if_registers_not_equal, op_subtract, op_subtract_reversed, op_xor)
+from .machine import Block, Machine, address, draw_sprite, font_address
+
+
+MAX_BLOCK_LENGTH = 32
+
+INLINE_TEMPLATES = {
+    op_clear_screen: ["machine.display = [0] * 32",
+                      "machine.display_dirty = True"],
+    op_set: ["registers[{x}] = {nn}"],
+    op_add: ["registers[{x}] = (registers[{x}] + {nn}) % 0x100"],
+    op_assign: ["registers[{x}] = registers[{y}]"],
+    op_or: ["registers[{x}] = registers[{x}] | registers[{y}]"],
+    op_and: ["registers[{x}] = registers[{x}] & registers[{y}]"],
+    op_xor: ["registers[{x}] = registers[{x}] ^ registers[{y}]"],
+    op_add_registers: ["total = registers[{x}] + registers[{y}]",
+                       "registers[{x}] = total & 0xFF",
+                       "registers[0xF] = 1 if total > 0xFF else 0"],
+    op_subtract: ["difference = registers[{x}] - registers[{y}]",
+                  "registers[{x}] = difference & 0xFF",
+                  "registers[0xF] = 1 if difference < 0x0 else 0"],
+    op_shift_right: ["registers[0xF] = registers[{x}] & 0b00000001",
+                     "registers[{x}] = registers[{x}] >> 1"],
+    op_subtract_reversed: ["difference = registers[{y}] - registers[{x}]",
+                           "registers[{x}] = difference & 0xFF",
+                           "if difference < 0:",
+                           "    registers[0xF] = 0",
+                           "else:",
+                           "    registers[0xF] = 1"],
+    op_shift_left: ["registers[0xF] = registers[{x}] & 0b10000000",
+                    "registers[{x}] = (registers[{x}] << 1) & 0b11111111"],
+    op_set_index: ["machine.I = {nnn}"],
+    op_random: ["registers[{x}] = random.randint(0, 255) & {nn}"],
+    op_get_delay_timer: ["registers[{x}] = machine.delay_timer"],
+    op_set_delay_timer: ["machine.delay_timer = registers[{x}]"],
+    op_set_sound_timer: ["machine.sound_timer = registers[{x}]"],
+    op_add_index: ["machine.I = (machine.I + registers[{x}]) % 0x10000"],
+    op_font: ["machine.I = font_address(registers[{x}])"],
+    op_load: ["registers[{i}] = memory[machine.I + {i}]"],   # repeated for i in 0..X
+    op_draw: ["draw_sprite(machine, registers[{x}], registers[{y}], {n})",
+              "machine.display_dirty = True"],
+}
+
+# Instructions which can raise (reading past the end of memory),  the program counter is set first
+RAISING = {op_load, op_draw}
+
+# Jumps and calls,  the block carries on from where they go
+FOLLOWED = {op_jump, op_call}
+
+# When each skip skips the next instruction
+SKIP_CONDITIONS = {
+    op_skip_if_equal: "registers[{x}] == {nn}",
+    op_skip_if_not_equal: "registers[{x}] != {nn}",
+    op_skip_if_registers_equal: "registers[{x}] == registers[{y}]",
+    op_skip_if_registers_not_equal: "registers[{x}] != registers[{y}]",
+    op_skip_if_key: "(machine.keys >> registers[{x}]) & 1",
+    op_skip_if_not_key: "not (machine.keys >> registers[{x}]) & 1",
+}
+
+
+def _fields(op: int) -> dict:
+    return {"x": (op >> 8) & 0xF, "y": (op >> 4) & 0xF, "n": op & 0xF, "nn": op & 0xFF, "nnn": op & 0xFFF}
+
+
+def translate_instruction(op: int, program_counter: address) -> List[str]:
+    handler = DISPATCH_TABLE[op]
+    lines = []
+    if handler in RAISING:
+        lines.append(f"machine.program_counter = {program_counter}")
+    if handler is op_load:
+        lines.extend(INLINE_TEMPLATES[op_load][0].format(i=i) for i in range(((op >> 8) & 0xF) + 1))
+    else:
+        lines.extend(line.format(**_fields(op)) for line in INLINE_TEMPLATES[handler])
+    return lines
+
+
+def translate_jump(op: int, program_counter: address) -> List[str]:
+    """
+        The source for a jump or call which the block follows,  carrying on from its target.
+    """
+    if DISPATCH_TABLE[op] is op_call:
+        # A stack overflow raises,  so the program counter is set first
+        return [f"machine.program_counter = {program_counter}",
+                f"machine.push({program_counter + 2})"]
+    return []
+
+
+def _stop(ran: int, program_counter: address, skips: bool) -> List[str]:
+    """
+        The source which leaves the block before the instruction at program_counter once the
+        budget has run out,  ran instructions in (less any skipped).
+    """
+    ran = f"{ran} - skipped" if skips else f"{ran}"
+    return [f"if budget == {ran}:",
+            f"    machine.program_counter = {program_counter}",
+            "    return budget"]
+
+
+def compile_block(machine: Machine, start: address) -> Block:
+    """
+        Compiles the block at start.  The function it makes takes a budget and leaves the
+        block early rather than run more instructions than that.
+    """
+    memory = machine.memory
+    namespace = {"random": random, "font_address": font_address, "draw_sprite": draw_sprite}
+    body = []
+    addresses = set()
+    skips = False   # Whether the block counts the instructions it skipped
+
+    program_counter = start
+    length = 0
+    while True:
+        if length == MAX_BLOCK_LENGTH or not 0 <= program_counter < 4095:
+            body.append(f"machine.program_counter = {program_counter}")
+            break
+        if length:
+            body.extend(_stop(length, program_counter, skips))
+        op = (memory[program_counter] << 8) | memory[program_counter + 1]
+        handler = DISPATCH_TABLE[op]
+        addresses.update((program_counter, program_counter + 1))
+        if handler in INLINE_TEMPLATES:
+            body.extend(translate_instruction(op, program_counter))
+            length = length + 1
+            program_counter = program_counter + 2
+            continue
+        if handler in FOLLOWED:
+            body.extend(translate_jump(op, program_counter))
+            length = length + 1
+            program_counter = op & 0xFFF
+            continue
+        if handler in SKIP_CONDITIONS and length + 2 <= MAX_BLOCK_LENGTH and program_counter + 3 < 4096:
+            condition = SKIP_CONDITIONS[handler].format(**_fields(op))
+            next_op = (memory[program_counter + 2] << 8) | memory[program_counter + 3]
+            next_handler = DISPATCH_TABLE[next_op]
+            if next_handler in INLINE_TEMPLATES:
+                skips = True
+                body.append(f"if {condition}:")
+                body.append("    skipped = skipped + 1")
+                body.append("else:")
+                body.extend("    " + line for line in _stop(length + 1, program_counter + 2, skips))
+                body.extend("    " + line for line in translate_instruction(next_op, program_counter + 2))
+                addresses.update((program_counter + 2, program_counter + 3))
+                length = length + 2
+                program_counter = program_counter + 4
+                continue
+            if next_handler in FOLLOWED:
+                # A branch,  leave the block if it skips the jump,  otherwise follow it
+                body.append(f"if {condition}:")
+                body.append(f"    machine.program_counter = {program_counter + 4}")
+                body.append(f"    return {length + 1}" + (" - skipped" if skips else ""))
+                body.extend(_stop(length + 1, program_counter + 2, skips))
+                body.extend(translate_jump(next_op, program_counter + 2))
+                addresses.update((program_counter + 2, program_counter + 3))
+                length = length + 2
+                program_counter = next_op & 0xFFF
+                continue
+        namespace["final_handler"] = handler
+        body.append(f"machine.program_counter = {program_counter}")
+        body.append(f"final_handler(machine, {op})")
+        length = length + 1
+        break
+    body.append(f"return {length}" + (" - skipped" if skips else ""))
+
+    lines = ["def block(machine, budget):",
+             "    registers = machine.registers",
+             "    memory = machine.memory"]
+    if skips:
+        lines.append("    skipped = 0")
+    lines.extend("    " + line for line in body)
+    source = "\n".join(lines) + "\n"
+    exec(compile(source, f"<block {hex(start)}>", "exec"), namespace)
+    return Block(start, sorted(addresses), length, namespace["block"], source)
+
+
+def run_blocks(machine: Machine, instructions: int) -> int:
+    """
+        Runs compiled blocks for exactly the given number of instructions.  The last block
+        is left part way through if need be,  so that frames (and so the timers) line up
+        with the other engines.  Stops early if FX0A parks the CPU.
+
+        Blocks only start where the flow of control lands:  a jump target,  or where another
+        block ended,  and only once it has landed there BlockCache.hot times.  Until then,
+        and where a block was left part way through at the end of the last frame,
+        instructions are run one at a time by cached_step().  So code which only runs a few
+        times isn't compiled,  and neither is every place a frame happens to end.
+    """
+    cache = machine.block_cache
+    blocks = cache.blocks
+    executed = 0
+    landed = False
+    while executed < instructions:
+        program_counter = machine.program_counter
+        block = blocks.get(program_counter)
+        if block is None:
+            if landed and 0 <= program_counter < 4095:
+                landings = cache.landings[program_counter] + 1
+                cache.landings[program_counter] = landings
+                landed = landings >= cache.hot
+            else:
+                # Off the ends of memory cached_step() raises the IndexError step() would
+                landed = False
+            if landed:
+                cache.misses += 1
+                block = compile_block(machine, program_counter)
+                cache.add(block)
+        if block is None:
+            cached_step(machine)
+            executed = executed + 1
+            landed = machine.program_counter != program_counter + 2
+        else:
+            executed = executed + block.run(machine, instructions - executed)
+            landed = True
+        if machine.waiting_for_key:
+            break
+    return executed